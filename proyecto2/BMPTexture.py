@@ -1,33 +1,121 @@
 import struct
+import numpy as np
+
+# Direccionamiento para coordenadas fuera de [0, 1)
+WRAP = 0
+CLAMP = 1
+
+# Filtrado
+NEAREST = 0
+BILINEAR = 1
 
 class BMPTexture(object):
-	def __init__(self, filename):
+	def __init__(self, filename, lowMemory = False):
+
+		self.filename = filename
 
 		with open(filename, "rb") as image:
 			image.seek(10)
-			headerSize = struct.unpack('=l', image.read(4))[0]
+			self.headerSize = struct.unpack('=l', image.read(4))[0]
 
 			image.seek(18)
 			self.width = struct.unpack('=l', image.read(4))[0]
-			self.height = struct.unpack('=l', image.read(4))[0]
+			self.storedHeight = struct.unpack('=l', image.read(4))[0]
 
-			image.seek(headerSize)
+			image.seek(28)
+			self.byteDepth = struct.unpack('=H', image.read(2))[0] // 8
 
-			self.pixels = []
+		# Una altura negativa indica filas guardadas de arriba hacia abajo
+		self.height = abs(self.storedHeight)
+
+		self.data = self._mapPixels()
+
+		# En modo de baja memoria solo se guarda la vista de 8 bits y los
+		# colores se convierten al consultarlos
+		if lowMemory:
+			self.pixels = None
+		else:
+			self.pixels = self.data.astype(np.float32) / 255
 
-			for y in range(self.height):
-				pixelRow = []
+		self.addressMode = WRAP
+		self.filterMode = NEAREST
 
-				for x in range(self.width):
-					b = ord(image.read(1)) / 255
-					g = ord(image.read(1)) / 255
-					r = ord(image.read(1)) / 255
-					pixelRow.append([r,g,b])
+	def _mapPixels(self):
+		# Los pixeles se leen directo del archivo mapeado en memoria; cada
+		# fila trae relleno hasta un multiplo de 4 bytes
+		rowSize = (self.width * self.byteDepth + 3) & ~3
+		raw = np.memmap(self.filename, dtype = np.uint8, mode = 'r', offset = self.headerSize,
+						shape = (self.height, rowSize))
 
-				self.pixels.append(pixelRow)
+		# Vista (alto, ancho, 3) en RGB sin convertir, con la fila 0 abajo
+		data = raw[:, :self.width * self.byteDepth].reshape(self.height, self.width, self.byteDepth)[:, :, 2::-1]
+
+		if self.storedHeight < 0:
+			data = data[::-1]
+
+		return data
+
+	def __getstate__(self):
+		# El archivo se vuelve a mapear al deserializar en lugar de copiar sus bytes
+		state = self.__dict__.copy()
+		state['data'] = None
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.data = self._mapPixels()
 
 	def getColor(self, u, v):
 		if 0 <= u < 1 and 0 <= v < 1:
-			return self.pixels[int(v * self.height)][int(u * self.width)]
+			y = int(v * self.height)
+			x = int(u * self.width)
+
+			if self.pixels is None:
+				return self.data[y, x] / 255
+
+			return self.pixels[y, x]
 		else:
-			return None
\ No newline at end of file
+			return None
+
+	def getColors(self, u, v, addressMode = None, filterMode = None):
+		# Version por lotes de getColor: u y v son arreglos (N,) y devuelve
+		# colores (N,3). Fuera de [0, 1) se repite (WRAP) o se extiende el
+		# borde (CLAMP) en lugar de devolver None.
+
+		addressMode = self.addressMode if addressMode is None else addressMode
+		filterMode = self.filterMode if filterMode is None else filterMode
+
+		u = np.asarray(u, dtype = float)
+		v = np.asarray(v, dtype = float)
+
+		if filterMode == BILINEAR:
+			# Los centros de los texeles estan en (i + 0.5) / ancho
+			fx = u * self.width - 0.5
+			fy = v * self.height - 0.5
+			x0 = np.floor(fx)
+			y0 = np.floor(fy)
+			tx = (fx - x0)[:, None]
+			ty = (fy - y0)[:, None]
+
+			x0 = self._address(x0, self.width, addressMode)
+			x1 = self._address(x0 + 1, self.width, addressMode)
+			y0 = self._address(y0, self.height, addressMode)
+			y1 = self._address(y0 + 1, self.height, addressMode)
+
+			bottom = self._texels(y0, x0) * (1 - tx) + self._texels(y0, x1) * tx
+			top = self._texels(y1, x0) * (1 - tx) + self._texels(y1, x1) * tx
+			return bottom * (1 - ty) + top * ty
+
+		x = self._address(np.floor(u * self.width), self.width, addressMode)
+		y = self._address(np.floor(v * self.height), self.height, addressMode)
+		return self._texels(y, x)
+
+	def _address(self, i, size, addressMode):
+		if addressMode == CLAMP:
+			return np.clip(i, 0, size - 1).astype(int)
+		return np.mod(i, size).astype(int)
+
+	def _texels(self, y, x):
+		if self.pixels is None:
+			return self.data[y, x] / 255
+		return self.pixels[y, x]
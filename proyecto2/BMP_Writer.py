@@ -1,6 +1,9 @@
 import struct
+import numpy as np
 
-def GenerateBMP(filename: str, width: int, height: int, byteDepth: int, colorBuffer: list[list[tuple[int, int, int]]]) -> None:
+def GenerateBMP(filename: str, width: int, height: int, byteDepth: int, colorBuffer: "np.ndarray | list[list[tuple[int, int, int]]]") -> None:
+    # colorBuffer puede ser un arreglo (alto, ancho, canales) con la fila 0
+    # abajo (uint8 0 - 255 o floats 0 - 1), o la lista colorBuffer[x][y] de antes.
     
     def char(c: str) -> bytes:
         # 1 byte
@@ -14,30 +17,50 @@ def GenerateBMP(filename: str, width: int, height: int, byteDepth: int, colorBuf
         # 4 bytes
         return struct.pack("<L", d)
 
-    with open(filename, "wb") as file:
+    if isinstance(colorBuffer, np.ndarray):
+        pixels = colorBuffer
+    else:
+        pixels = np.asarray(colorBuffer).swapaxes(0, 1)
+
+    if pixels.dtype.kind == "f":
+        pixels = np.clip(pixels, 0, 1) * 255
+
+    pixels = pixels[:height, :width].astype(np.uint8)
+
+    # Cada fila se guarda en BGR(A) y se rellena hasta un multiplo de 4 bytes
+    rowSize = (width * byteDepth + 3) & ~3
+    imageSize = rowSize * height
+
+    rows = np.zeros((height, rowSize), dtype=np.uint8)
+    bgr = rows[:, :width * byteDepth].reshape(height, width, byteDepth)
+    bgr[:, :, :3] = pixels[:, :, 2::-1]
+    if byteDepth == 4:
+        bgr[:, :, 3] = pixels[:, :, 3] if pixels.shape[2] > 3 else 255
+
+    header = b"".join([
         # Header
-        file.write(char("B"))
-        file.write(char("M"))
-        file.write(dword(14 + 40 + (width * height * byteDepth)))
-        file.write(dword(0))
-        file.write(dword(14 + 40))
-        
+        char("B"),
+        char("M"),
+        dword(14 + 40 + imageSize),
+        dword(0),
+        dword(14 + 40),
+
         # Info Header
-        file.write(dword(40))
-        file.write(dword(width))
-        file.write(dword(height))
-        file.write(word(1))
-        file.write(word(byteDepth * 8))
-        file.write(dword(0))
-        file.write(dword(width * height * byteDepth))
-        file.write(dword(0))
-        file.write(dword(0))
-        file.write(dword(0))
-        file.write(dword(0))
+        dword(40),
+        dword(width),
+        dword(height),
+        word(1),
+        word(byteDepth * 8),
+        dword(0),
+        dword(imageSize),
+        dword(0),
+        dword(0),
+        dword(0),
+        dword(0),
+    ])
+
+    with open(filename, "wb") as file:
+        file.write(header)
         
         # Color table
-        for y in range(height):
-            for x in range(width):
-                color = colorBuffer[x][y]
-                for i in range(len(color) - 1, -1, -1):
-                    file.write(color[i].to_bytes(1, "little"))
+        file.write(rows.tobytes())
@@ -1,26 +1,31 @@
 import numpy as np
 from math import pi, sin, cos, isclose
+from functools import lru_cache
 
 
 
 def TranslationMatrix(x, y, z):
 	
-	return np.matrix([[1, 0, 0, x],
-					  [0, 1, 0, y],
-					  [0, 0, 1, z],
-					  [0, 0, 0, 1]])
+	return np.array([[1, 0, 0, x],
+					 [0, 1, 0, y],
+					 [0, 0, 1, z],
+					 [0, 0, 0, 1]])
 
 
 
 def ScaleMatrix(x, y, z):
 	
-	return np.matrix([[x, 0, 0, 0],
-					  [0, y, 0, 0],
-					  [0, 0, z, 0],
-					  [0, 0, 0, 1]])
+	return np.array([[x, 0, 0, 0],
+					 [0, y, 0, 0],
+					 [0, 0, z, 0],
+					 [0, 0, 0, 1]])
 
 
 
+# Las rotaciones se repiten mucho entre cuadros y objetos, asi que se
+# guardan; el resultado es de solo lectura para que nadie altere la copia
+# compartida.
+@lru_cache(maxsize = 4096)
 def RotationMatrix(pitch, yaw, roll):
 	
 	# Convertir a radianes
@@ -29,26 +34,36 @@ def RotationMatrix(pitch, yaw, roll):
 	roll *= pi/180
 	
 	# Creamos la matriz de rotaci�n para cada eje.
-	pitchMat = np.matrix([[1,0,0,0],
-						  [0,cos(pitch),-sin(pitch),0],
-						  [0,sin(pitch),cos(pitch),0],
-						  [0,0,0,1]])
+	pitchMat = np.array([[1,0,0,0],
+						 [0,cos(pitch),-sin(pitch),0],
+						 [0,sin(pitch),cos(pitch),0],
+						 [0,0,0,1]])
 	
-	yawMat = np.matrix([[cos(yaw),0,sin(yaw),0],
+	yawMat = np.array([[cos(yaw),0,sin(yaw),0],
 						[0,1,0,0],
 						[-sin(yaw),0,cos(yaw),0],
 						[0,0,0,1]])
 	
-	rollMat = np.matrix([[cos(roll),-sin(roll),0,0],
-						 [sin(roll),cos(roll),0,0],
-						 [0,0,1,0],
-						 [0,0,0,1]])
+	rollMat = np.array([[cos(roll),-sin(roll),0,0],
+						[sin(roll),cos(roll),0,0],
+						[0,0,1,0],
+						[0,0,0,1]])
 	
-	return pitchMat * yawMat * rollMat
+	rotateMat = pitchMat @ yawMat @ rollMat
+	rotateMat.setflags(write = False)
+	return rotateMat
 
 def reflectVector(normal, direction):
 	reflect = 2 * np.dot(normal, direction)
 	reflect = np.multiply(reflect, normal)
 	reflect = np.subtract(reflect, direction)
 	reflect /= np.linalg.norm(reflect)
-	return reflect
\ No newline at end of file
+	return reflect
+
+def reflectVectorBatch(normals, directions):
+	# reflectVector para arreglos (N,3) de normales y direcciones
+	reflect = 2 * np.einsum('ij,ij->i', normals, directions)[:, None]
+	reflect = np.multiply(reflect, normals)
+	reflect = np.subtract(reflect, directions)
+	reflect /= np.linalg.norm(reflect, axis = 1, keepdims = True)
+	return reflect
@@ -6,15 +6,28 @@ from figures import *
 from lights import * 
 from material import *
 from BMPTexture import BMPTexture
+from instance import Instance
+from model import Model
 import os
+import sys
  
 width = 1920
 height = 1080
 
-screen = pygame.display.set_mode((width, height), pygame.SCALED)
-clock = pygame.time.Clock()
+# Con --headless se renderiza sin ventana y solo se escribe output.bmp
+headless = "--headless" in sys.argv
 
-rend = Renderer(screen)
+# Con --preview la ventana muestra una vista previa que se refina por
+# niveles; las flechas mueven la camara y reinician la vista previa
+preview = "--preview" in sys.argv and not headless
+
+if headless:
+    rend = Renderer(width = width, height = height)
+else:
+    screen = pygame.display.set_mode((width, height), pygame.SCALED)
+    clock = pygame.time.Clock()
+
+    rend = Renderer(screen)
 
 base_path = os.path.dirname(__file__)
 background_path = os.path.join(base_path, "textures/background_hdri.bmp")
@@ -43,16 +56,14 @@ obsidiana = Material(diffuse=[0.02, 0.025, 0.03], spec=110, ks=0.85, ior=1.52, m
 # Suelo (plano)
 rend.scene.append(Plane(position = [0, -2, 0], normal = [0, 1, 0], material = obsidiana))
 
-# Montañas (cono)
-rend.scene.append(Cone(position = [-2, -2, -8], radius = 1, height = 2.75, material = cyan))
-rend.scene.append(Cone(position = [-3, -2, -7], radius = 1, height = 2.75, material = cyan))
-rend.scene.append(Cone(position = [-4, -2, -6], radius = 1, height = 2.75, material = cyan))
-rend.scene.append(Cone(position = [-5, -2, -5], radius = 1, height = 2.75, material = cyan))
+# Montañas (cono): una sola figura y una instancia por posicion
+mountainCone = Cone(position = [0, 0, 0], radius = 1, height = 2.75, material = cyan)
 
-rend.scene.append(Cone(position = [2, -2, -8], radius = 1, height = 2.75, material = cyan))
-rend.scene.append(Cone(position = [3, -2, -7], radius = 1, height = 2.75, material = cyan))
-rend.scene.append(Cone(position = [4, -2, -6], radius = 1, height = 2.75, material = cyan))
-rend.scene.append(Cone(position = [5, -2, -5], radius = 1, height = 2.75, material = cyan))
+for position in ([-2, -2, -8], [-3, -2, -7], [-4, -2, -6], [-5, -2, -5],
+                 [2, -2, -8], [3, -2, -7], [4, -2, -6], [5, -2, -5]):
+    coneModel = Model()
+    coneModel.translation = position
+    rend.scene.append(Instance(mountainCone, coneModel))
 
 # Sol (esfera)
 rend.scene.append(Sphere(position = [0, 3, -15], radius = 5, material = oro))
@@ -87,9 +98,15 @@ rend.lights.append(PointLight(position = [3, -1.9, -5], intensity = 1, color = [
 rend.lights.append(PointLight(position = [4, -1.9, -4], intensity = 1, color = [0.168627451, 1.0, 0.976470588]))
 rend.lights.append(PointLight(position = [5, -1.9, -3], intensity = 1, color = [0.168627451, 1.0, 0.976470588]))
 
-rend.glRender() 
+if preview:
+    previewRenderer = rend.glPreview()
+else:
+    rend.glRender() 
+
+cameraKeys = {pygame.K_LEFT: (0, -0.5), pygame.K_RIGHT: (0, 0.5),
+              pygame.K_UP: (2, -0.5), pygame.K_DOWN: (2, 0.5)}
 
-isRunning = True
+isRunning = not headless
 while isRunning:
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
@@ -97,12 +114,17 @@ while isRunning:
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_ESCAPE:
                 isRunning = False
+            elif preview and event.key in cameraKeys:
+                axis, step = cameraKeys[event.key]
+                rend.camera.translation[axis] += step
 
+    if preview:
+        previewRenderer.Update()
 
     pygame.display.flip()
     clock.tick(60)
 
 
-GenerateBMP('output.bmp', width, height, 3, rend.frameBuffer)
+GenerateBMP('output.bmp', width, height, 3, rend.glFrameBufferBytes())
 
 pygame.quit
\ No newline at end of file
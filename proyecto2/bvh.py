@@ -0,0 +1,320 @@
+import numpy as np
+from figures import no_hits
+
+# Jerarquia de volumenes envolventes (BVH) guardada en arreglos planos:
+# cada nodo tiene su caja [nodeMin, nodeMax]; los nodos internos apuntan a
+# sus hijos con left/right y las hojas cubren items[first:first + count].
+
+class BVH(object):
+    def __init__(self, bounds, leafSize = 4):
+        # bounds: arreglo (N, 2, 3) con la caja minima y maxima de cada elemento
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 2, 3)
+        self.leafSize = leafSize
+
+        nodeMin, nodeMax, left, right, first, count = [], [], [], [], [], []
+        self.items = np.arange(len(bounds))
+
+        if len(bounds) == 0:
+            self._SetArrays(nodeMin, nodeMax, left, right, first, count)
+            return
+
+        # Un pequeño margen evita cajas sin grosor (triangulos, discos alineados)
+        lo = bounds[:, 0] - 1e-6
+        hi = bounds[:, 1] + 1e-6
+        centroids = (lo + hi) / 2
+
+        def Node():
+            nodeMin.append(None)
+            nodeMax.append(None)
+            left.append(-1)
+            right.append(-1)
+            first.append(0)
+            count.append(0)
+            return len(nodeMin) - 1
+
+        stack = [(Node(), 0, len(bounds))]
+        while stack:
+            node, start, end = stack.pop()
+            items = self.items[start:end]
+
+            nodeMin[node] = lo[items].min(axis = 0)
+            nodeMax[node] = hi[items].max(axis = 0)
+
+            if end - start <= leafSize:
+                first[node] = start
+                count[node] = end - start
+                continue
+
+            # Division por la mediana en el eje mas largo de los centroides
+            c = centroids[items]
+            axis = np.argmax(c.max(axis = 0) - c.min(axis = 0))
+            self.items[start:end] = items[np.argsort(c[:, axis], kind = 'stable')]
+            mid = (start + end) // 2
+
+            left[node] = Node()
+            right[node] = Node()
+            stack.append((right[node], mid, end))
+            stack.append((left[node], start, mid))
+
+        self._SetArrays(nodeMin, nodeMax, left, right, first, count)
+
+    def _SetArrays(self, nodeMin, nodeMax, left, right, first, count):
+        self.nodeMin = np.asarray(nodeMin, dtype=float).reshape(-1, 3)
+        self.nodeMax = np.asarray(nodeMax, dtype=float).reshape(-1, 3)
+        self.left = np.asarray(left, dtype=int)
+        self.right = np.asarray(right, dtype=int)
+        self.first = np.asarray(first, dtype=int)
+        self.count = np.asarray(count, dtype=int)
+
+        # Copias en listas de Python para el recorrido de un solo rayo, que
+        # es mas rapido con floats que con arreglos de 3 elementos
+        self._nodes = list(zip(self.nodeMin.tolist(), self.nodeMax.tolist(),
+                               self.left.tolist(), self.right.tolist(),
+                               self.first.tolist(), self.count.tolist()))
+
+    def __getstate__(self):
+        # Solo se serializan los arreglos; las listas se rearman al recibirlos
+        state = self.__dict__.copy()
+        del state['_nodes']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._SetArrays(self.nodeMin, self.nodeMax, self.left, self.right, self.first, self.count)
+
+    def Traverse(self, orig, dir, testLeaf, maxDistance = float('inf')):
+        # Recorre el arbol de cerca a lejos. testLeaf(items, maxDistance)
+        # prueba los elementos de una hoja y devuelve la nueva distancia
+        # maxima; un valor negativo termina el recorrido.
+
+        if not self._nodes:
+            return
+
+        orig = [float(i) for i in orig]
+        invdir = [1.0 / (float(i) if i != 0 else 1e-30) for i in dir]
+
+        tRoot = self._Slab(0, orig, invdir, maxDistance)
+        if tRoot is None:
+            return
+
+        stack = [(0, tRoot)]
+
+        while stack:
+            node, tnear = stack.pop()
+            if tnear > maxDistance:
+                continue
+
+            _, _, left, right, first, count = self._nodes[node]
+
+            if count > 0:
+                maxDistance = testLeaf(self.items[first:first + count], maxDistance)
+                if maxDistance < 0:
+                    return
+                continue
+
+            tLeft = self._Slab(left, orig, invdir, maxDistance)
+            tRight = self._Slab(right, orig, invdir, maxDistance)
+
+            # Se apila primero el hijo lejano para visitar antes el cercano
+            if tLeft is not None and tRight is not None:
+                if tLeft <= tRight:
+                    stack.append((right, tRight))
+                    stack.append((left, tLeft))
+                else:
+                    stack.append((left, tLeft))
+                    stack.append((right, tRight))
+            elif tLeft is not None:
+                stack.append((left, tLeft))
+            elif tRight is not None:
+                stack.append((right, tRight))
+
+    def _Slab(self, node, orig, invdir, maxDistance):
+        lo, hi = self._nodes[node][0], self._nodes[node][1]
+        tnear, tfar = 0.0, maxDistance
+
+        for a in range(3):
+            t0 = (lo[a] - orig[a]) * invdir[a]
+            t1 = (hi[a] - orig[a]) * invdir[a]
+            if t0 > t1:
+                t0, t1 = t1, t0
+            if t0 > tnear:
+                tnear = t0
+            if t1 < tfar:
+                tfar = t1
+            if tnear > tfar:
+                return None
+
+        return tnear
+
+    def TraverseBatch(self, orig, dir, depth, testLeaf):
+        # Recorre el arbol con paquetes de rayos: cada nodo se prueba contra
+        # los rayos que siguen vivos y solo esos bajan a los hijos.
+        # testLeaf(items, rays) debe actualizar depth[rays] con sus impactos.
+
+        if not self._nodes:
+            return
+
+        with np.errstate(divide='ignore'):
+            invdir = 1.0 / np.where(dir == 0, 1e-30, dir)
+
+        stack = [(0, np.arange(len(dir)))]
+
+        while stack:
+            node, rays = stack.pop()
+
+            t0 = (self.nodeMin[node] - orig[rays]) * invdir[rays]
+            t1 = (self.nodeMax[node] - orig[rays]) * invdir[rays]
+            tnear = np.maximum(np.minimum(t0, t1).max(axis = 1), 0.0)
+            tfar = np.minimum(np.maximum(t0, t1).min(axis = 1), depth[rays])
+
+            rays = rays[tnear <= tfar]
+            if len(rays) == 0:
+                continue
+
+            if self.count[node] > 0:
+                first = self.first[node]
+                testLeaf(self.items[first:first + self.count[node]], rays)
+            else:
+                stack.append((self.right[node], rays))
+                stack.append((self.left[node], rays))
+
+
+class SceneBVH(object):
+    # BVH sobre los objetos de la escena. Las figuras sin caja envolvente
+    # (planos infinitos) se guardan aparte y se prueban siempre.
+
+    def __init__(self, objects):
+        self.objects = list(objects)
+
+        bounds = []
+        self.bounded = []
+        self.unbounded = []
+
+        for i, obj in enumerate(self.objects):
+            box = obj.GetBounds()
+            if box is None:
+                self.unbounded.append(i)
+            else:
+                self.bounded.append(i)
+                bounds.append(box)
+
+        self.bounded = np.array(self.bounded, dtype=int)
+        self.tree = BVH(bounds)
+
+    def ray_intersect(self, orig, dir, sceneObj = None):
+        # Igual que recorrer la escena en orden: a la misma distancia gana
+        # el objeto que aparece primero en la lista
+        best = [None, len(self.objects)]
+
+        def test(i, maxDistance):
+            obj = self.objects[i]
+            if obj != sceneObj:
+                intercept = obj.ray_intersect(orig, dir)
+                if intercept != None:
+                    if intercept.distance < maxDistance or (intercept.distance == maxDistance and i < best[1]):
+                        best[0], best[1] = intercept, i
+                        maxDistance = intercept.distance
+            return maxDistance
+
+        depht = float('inf')
+        for i in self.unbounded:
+            depht = test(i, depht)
+
+        def testLeaf(items, maxDistance):
+            for i in items:
+                maxDistance = test(self.bounded[i], maxDistance)
+            return maxDistance
+
+        self.tree.Traverse(orig, dir, testLeaf, depht)
+
+        return best[0]
+
+    def ray_intersect_batch(self, orig, dir, sceneObj = None, exclude = None):
+        orig = np.broadcast_to(np.asarray(orig, dtype=float), np.shape(dir))
+        depth, normal, texCoord, _ = no_hits(len(dir))
+        index = np.full(len(dir), -1)
+
+        def test(i, rays):
+            obj = self.objects[i]
+            if obj == sceneObj:
+                return
+            if exclude is not None:
+                rays = rays[exclude[rays] != i]
+                if len(rays) == 0:
+                    return
+            distance, objNormal, objTexCoord, hit = obj.ray_intersect_batch(orig[rays], dir[rays])
+            closer = hit & ((distance < depth[rays]) | ((distance == depth[rays]) & (i < index[rays])))
+            rays = rays[closer]
+            depth[rays] = distance[closer]
+            normal[rays] = objNormal[closer]
+            texCoord[rays] = objTexCoord[closer]
+            index[rays] = i
+
+        for i in self.unbounded:
+            test(i, np.arange(len(dir)))
+
+        def testLeaf(items, rays):
+            for i in items:
+                test(self.bounded[i], rays)
+
+        self.tree.TraverseBatch(orig, dir, depth, testLeaf)
+
+        return depth, normal, texCoord, index
+
+    def occluder(self, orig, dir, maxDistance = float('inf'), sceneObj = None):
+        # Basta con cualquier impacto antes de maxDistance: el recorrido
+        # termina con el primero que encuentre. Devuelve su indice o -1.
+        def test(i):
+            obj = self.objects[i]
+            if obj != sceneObj:
+                intercept = obj.ray_intersect(orig, dir)
+                return intercept != None and intercept.distance < maxDistance
+            return False
+
+        for i in self.unbounded:
+            if test(i):
+                return i
+
+        found = [-1]
+
+        def testLeaf(items, distance):
+            for i in items:
+                if test(self.bounded[i]):
+                    found[0] = self.bounded[i]
+                    return -1
+            return distance
+
+        self.tree.Traverse(orig, dir, testLeaf, maxDistance)
+
+        return found[0]
+
+    def occluder_batch(self, orig, dir, maxDistance = np.inf, sceneObj = None, exclude = None):
+        orig = np.broadcast_to(np.asarray(orig, dtype=float), np.shape(dir))
+        depth = np.array(np.broadcast_to(maxDistance, len(dir)), dtype=float)
+        occluder = np.full(len(dir), -1)
+
+        def test(i, rays):
+            obj = self.objects[i]
+            if obj == sceneObj:
+                return
+            rays = rays[occluder[rays] < 0]
+            if exclude is not None:
+                rays = rays[exclude[rays] != i]
+            if len(rays) == 0:
+                return
+            distance, _, _, hit = obj.ray_intersect_batch(orig[rays], dir[rays])
+            rays = rays[hit & (distance < depth[rays])]
+            occluder[rays] = i
+            # Con distancia negativa el recorrido ya no baja por estos rayos
+            depth[rays] = -1
+
+        for i in self.unbounded:
+            test(i, np.arange(len(dir)))
+
+        def testLeaf(items, rays):
+            for i in items:
+                test(self.bounded[i], rays)
+
+        self.tree.TraverseBatch(orig, dir, depth, testLeaf)
+
+        return occluder
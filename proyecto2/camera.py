@@ -1,19 +1,18 @@
 from Mathlib import *
+from transform import ViewTransform
 
 class Camera(object):
     def __init__(self):
         self.translation = [0,0,0]
         self.rotation = [0,0,0]
 
-    def GetViewMatrix(self):
-        translateMat = TranslationMatrix(self.translation[0],
-                                         self.translation[1],
-                                         self.translation[2])
-        
-        rotateMat = RotationMatrix(self.rotation[0],
-                                   self.rotation[1],
-                                   self.rotation[2])
-        
-        camMatrix = rotateMat * translateMat
+    def GetBasis(self):
+        # Rotacion de camara a mundo (3x3): las columnas son los ejes
+        # derecha, arriba y atras de la camara en el mundo
+        return RotationMatrix(self.rotation[0],
+                              self.rotation[1],
+                              self.rotation[2])[:3, :3]
 
-        return np.linalg.inv(camMatrix)
\ No newline at end of file
+    def GetViewMatrix(self):
+        # Mundo a camara; la inversa queda guardada junto a la pose
+        return ViewTransform(self.translation, self.rotation).GetInverse()
\ No newline at end of file
@@ -0,0 +1,435 @@
+import numpy as np
+from figures import Sphere, Plane, Disk, AABB, Triangle, Cylinder, no_hits
+from mesh import IntersectTriangles
+from math import pi
+
+# Escena compilada: las figuras se agrupan por tipo y los parametros de cada
+# grupo se empacan en arreglos (estructura de arreglos). Asi un lote de N
+# rayos se prueba contra las M esferas, triangulos, etc. de una sola vez con
+# broadcasting (N,1,3) contra (M,3), en lugar de llamar ray_intersect_batch
+# objeto por objeto. Las figuras sin grupo se prueban una por una.
+#
+# Cada grupo calcula primero solo la matriz de distancias (N,M); la normal y
+# las coordenadas de textura se calculan despues unicamente para la figura
+# mas cercana de cada rayo.
+
+# Limite de elementos de los arreglos intermedios (rayos x figuras x 3)
+MAX_ELEMENTS = 1 << 18
+
+def _dot(a, b):
+    return np.einsum('...k,...k->...', a, b)
+
+
+class PrimitiveGroup(object):
+    shape = None
+
+    # Arreglos que se pueden pasar a memoria compartida al renderizar en
+    # paralelo; indices lo asigna CompiledScene.Update
+    sharedArrays = ('indices',)
+
+    def __init__(self, objects):
+        self.objects = list(objects)
+        self.Pack(self.objects)
+
+    # Cada grupo define:
+    #   Pack(objects): empaca los parametros de sus figuras en arreglos
+    #   Params(): esos arreglos, con la figura en el primer eje
+    #   Distances(orig, dir, params): orig y dir (N,1,3) contra params (1,M,...);
+    #       devuelve (N,M) con inf donde no hay impacto
+    #   Attributes(orig, dir, t, params): orig y dir (K,3) con los parametros
+    #       de la figura que gano cada rayo; devuelve normal (K,3) y
+    #       coordenadas de textura (K,2) o None
+
+    def Intersect(self, orig, dir):
+        # Devuelve, por rayo, la distancia (N,M) a cada figura del grupo
+        params = [p[None] for p in self.Params()]
+        return self.Distances(orig[:, None], dir[:, None], params)
+
+    def Shade(self, orig, dir, t, item):
+        params = [p[item] for p in self.Params()]
+        return self.Attributes(orig, dir, t, params)
+
+
+class SphereGroup(PrimitiveGroup):
+    shape = Sphere
+    sharedArrays = PrimitiveGroup.sharedArrays + ('center', 'radius')
+
+    def Pack(self, objects):
+        self.center = np.array([obj.position for obj in objects], dtype=float).reshape(-1, 3)
+        self.radius = np.array([obj.radius for obj in objects], dtype=float)
+
+    def Params(self):
+        return self.center, self.radius
+
+    def Distances(self, orig, dir, params):
+        center, radius = params
+
+        L = center - orig
+        tca = _dot(L, dir)
+        d2 = _dot(L, L) - tca ** 2
+
+        hit = d2 <= radius ** 2
+        thc = np.sqrt(np.maximum(radius ** 2 - d2, 0))
+
+        distance = tca - thc
+        distance = np.where(distance < 0, tca + thc, distance)
+        hit &= distance >= 0
+
+        return np.where(hit, distance, np.inf)
+
+    def Attributes(self, orig, dir, t, params):
+        center, radius = params
+
+        normal = orig + dir * t[:, None] - center
+        normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+
+        u = -np.arctan2(normal[:, 2], normal[:, 0]) / (2 * pi) + 0.5
+        v = np.arccos(np.clip(-normal[:, 1], -1, 1)) / pi
+
+        return normal, np.stack((u, v), axis=1)
+
+
+class PlaneGroup(PrimitiveGroup):
+    shape = Plane
+    sharedArrays = PrimitiveGroup.sharedArrays + ('position', 'normal')
+
+    def Pack(self, objects):
+        self.position = np.array([obj.position for obj in objects], dtype=float).reshape(-1, 3)
+        self.normal = np.array([obj.normal for obj in objects], dtype=float).reshape(-1, 3)
+
+    def Params(self):
+        return self.position, self.normal
+
+    def Distances(self, orig, dir, params):
+        position, normal = params[:2]
+
+        denom = _dot(dir, normal)
+        hit = np.abs(denom) >= 1e-6
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = _dot(position - orig, normal) / denom
+        hit &= t >= 0
+
+        return np.where(hit, t, np.inf)
+
+    def Attributes(self, orig, dir, t, params):
+        return params[1], None
+
+
+class DiskGroup(PlaneGroup):
+    shape = Disk
+    sharedArrays = PlaneGroup.sharedArrays + ('radius',)
+
+    def Pack(self, objects):
+        super().Pack(objects)
+        self.radius = np.array([obj.radius for obj in objects], dtype=float)
+
+    def Params(self):
+        return self.position, self.normal, self.radius
+
+    def Distances(self, orig, dir, params):
+        position, normal, radius = params
+
+        t = super().Distances(orig, dir, params)
+        hit = np.isfinite(t)
+
+        v = orig + dir * np.where(hit, t, 0)[..., None] - position
+        hit &= _dot(v, v) <= radius * radius
+
+        return np.where(hit, t, np.inf)
+
+
+class AABBGroup(PrimitiveGroup):
+    shape = AABB
+    sharedArrays = PrimitiveGroup.sharedArrays + ('minBound', 'maxBound')
+
+    def Pack(self, objects):
+        self.minBound = np.array([obj.min_bound for obj in objects], dtype=float).reshape(-1, 3)
+        self.maxBound = np.array([obj.max_bound for obj in objects], dtype=float).reshape(-1, 3)
+
+    def Params(self):
+        return self.minBound, self.maxBound
+
+    def Distances(self, orig, dir, params):
+        minBound, maxBound = params
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            invdir = 1.0 / dir
+            t0 = (minBound - orig) * invdir
+            t1 = (maxBound - orig) * invdir
+
+            tmin = np.nanmax(np.minimum(t0, t1), axis=-1)
+            tmax = np.nanmin(np.maximum(t0, t1), axis=-1)
+
+        hit = (tmin <= tmax) & (tmax >= 0)
+        distance = np.where(tmin > 0, tmin, tmax)
+
+        return np.where(hit, distance, np.inf)
+
+    def Attributes(self, orig, dir, t, params):
+        minBound, maxBound = params
+        point = orig + dir * t[:, None]
+
+        epsilon = 1e-6
+        normal = np.where(np.abs(point - minBound) < epsilon, -1.0, 0.0)
+        normal = np.where((normal == 0) & (np.abs(point - maxBound) < epsilon), 1.0, normal)
+
+        return normal, None
+
+
+class TriangleGroup(PrimitiveGroup):
+    shape = Triangle
+    sharedArrays = PrimitiveGroup.sharedArrays + ('v0', 'e1', 'e2', 'normal')
+
+    def Pack(self, objects):
+        self.v0 = np.array([obj.v0 for obj in objects], dtype=float).reshape(-1, 3)
+        self.e1 = np.array([obj.v1 for obj in objects], dtype=float).reshape(-1, 3) - self.v0
+        self.e2 = np.array([obj.v2 for obj in objects], dtype=float).reshape(-1, 3) - self.v0
+        self.normal = np.array([obj.normal for obj in objects], dtype=float).reshape(-1, 3)
+
+    def Params(self):
+        return self.v0, self.e1, self.e2, self.normal
+
+    def Distances(self, orig, dir, params):
+        v0, e1, e2, _ = params
+        return IntersectTriangles(orig, dir, v0, e1, e2)[0]
+
+    def Attributes(self, orig, dir, t, params):
+        return params[3], None
+
+
+class CylinderGroup(PrimitiveGroup):
+    shape = Cylinder
+    sharedArrays = PrimitiveGroup.sharedArrays + ('position', 'radius', 'height')
+
+    def Pack(self, objects):
+        self.position = np.array([obj.position for obj in objects], dtype=float).reshape(-1, 3)
+        self.radius = np.array([obj.radius for obj in objects], dtype=float)
+        self.height = np.array([obj.height for obj in objects], dtype=float)
+
+    def Params(self):
+        return self.position, self.radius, self.height
+
+    def Candidates(self, orig, dir, params):
+        # Distancias al costado y a las tapas inferior y superior
+        position, radius, height = params
+        oc = orig - position
+        dx, dy, dz = dir[..., 0], dir[..., 1], dir[..., 2]
+
+        a = dx**2 + dz**2
+        b = 2.0 * (oc[..., 0]*dx + oc[..., 2]*dz)
+        c = oc[..., 0]**2 + oc[..., 2]**2 - radius**2
+
+        EPS = 1e-6
+        disc = b*b - 4*a*c
+        valid = (np.abs(a) > EPS) & (disc >= -EPS)
+        sqrt_disc = np.sqrt(np.maximum(disc, 0.0))
+        a2 = np.where(valid, 2*a, 1.0)
+
+        def lateral(t):
+            y_local = oc[..., 1] + t*dy
+            return valid & (t > EPS) & (y_local >= 0) & (y_local <= height)
+
+        t0 = (-b - sqrt_disc) / a2
+        t1 = (-b + sqrt_disc) / a2
+        t_lateral = np.where(lateral(t0), t0, np.where(lateral(t1), t1, np.inf))
+
+        # Tapas: discos con normal -y en la base y +y a la altura height
+        def cap(center, sign):
+            denom = dy * sign
+            hit = np.abs(denom) >= 1e-6
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = ((center[..., 1] - orig[..., 1]) * sign) / denom
+            hit = hit & (t >= 0)
+            v = orig + dir * np.where(hit, t, 0)[..., None] - center
+            hit &= _dot(v, v) <= radius * radius
+            return np.where(hit, t, np.inf)
+
+        top = position + np.stack((np.zeros_like(height), height, np.zeros_like(height)), axis=-1)
+        return t_lateral, cap(position, -1.0), cap(top, 1.0)
+
+    def Distances(self, orig, dir, params):
+        t_lateral, t_bottom, t_top = self.Candidates(orig, dir, params)
+        return np.minimum(np.minimum(t_lateral, t_bottom), t_top)
+
+    def Attributes(self, orig, dir, t, params):
+        position, radius, height = params
+
+        candidates = np.stack(self.Candidates(orig, dir, params), axis=1)
+        tag = np.argmin(candidates, axis=1)
+
+        local = orig + dir * t[:, None] - position
+
+        normal = local * [1, 0, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+        normal = np.where((tag == 1)[:, None], [0.0, -1.0, 0.0], normal)
+        normal = np.where((tag == 2)[:, None], [0.0, 1.0, 0.0], normal)
+
+        theta = -np.arctan2(local[:, 2], local[:, 0])
+        rho = (local[:, 0]**2 + local[:, 2]**2) ** 0.5 / radius
+        u = (theta / (2 * pi)) + 0.5
+        v = np.where(tag == 0, local[:, 1] / height, rho)
+
+        u = u - np.floor(u)
+        v = np.clip(v, 0.0, 1.0)
+
+        return normal, np.stack((u, v), axis=1)
+
+
+GROUPS = (SphereGroup, PlaneGroup, DiskGroup, AABBGroup, TriangleGroup, CylinderGroup)
+
+
+class CompiledScene(object):
+    def __init__(self, objects):
+        self.objects = []
+        self.groups = {}
+        self.others = []
+        self.Update(objects)
+
+    def Update(self, objects):
+        # Vuelve a agrupar y empacar la escena. Se empaca todo de nuevo
+        # porque una figura se puede mover o cambiar de tamaño sin dejar de
+        # ser el mismo objeto. Devuelve la lista de grupos cuyos arreglos
+        # cambiaron.
+
+        self.objects = list(objects)
+        kinds = {group.shape: group for group in GROUPS}
+
+        members = {group: [] for group in GROUPS}
+        self.others = []
+
+        # El tipo exacto decide el grupo: un Disk no es un Plane cualquiera
+        for i, obj in enumerate(self.objects):
+            group = kinds.get(type(obj))
+            if group:
+                members[group].append(i)
+            else:
+                self.others.append(i)
+
+        compiled = []
+        groups = {}
+
+        for group, indices in members.items():
+            if not indices:
+                continue
+
+            objs = [self.objects[i] for i in indices]
+            previous = self.groups.get(group)
+            groups[group] = group(objs)
+
+            if not previous or any(not np.array_equal(a, b) for a, b in zip(previous.Params(), groups[group].Params())):
+                compiled.append(group)
+
+            groups[group].indices = np.array(indices, dtype=int)
+
+        self.groups = groups
+        return compiled
+
+    def ray_intersect_batch(self, orig, dir, sceneObj = None, exclude = None):
+        dir = np.asarray(dir, dtype=float)
+        orig = np.broadcast_to(np.asarray(orig, dtype=float), dir.shape)
+
+        depth, normal, texCoord, _ = no_hits(len(dir))
+        index = np.full(len(dir), -1)
+        item = np.full(len(dir), -1)
+
+        def merge(rays, distance, i, k = -1):
+            # A la misma distancia gana el objeto que aparece primero en la escena
+            closer = (distance < depth[rays]) | ((distance == depth[rays]) & (i < index[rays]))
+            rays = rays[closer]
+            depth[rays] = distance[closer]
+            index[rays] = i[closer] if np.ndim(i) else i
+            item[rays] = k[closer] if np.ndim(k) else k
+            return rays, closer
+
+        for group in self.groups.values():
+            M = len(group.objects)
+            chunk = max(1, MAX_ELEMENTS // (3 * M))
+
+            for start in range(0, len(dir), chunk):
+                rays = np.arange(start, min(start + chunk, len(dir)))
+                distance = group.Intersect(orig[rays], dir[rays])
+
+                if sceneObj is not None:
+                    distance[:, [obj is sceneObj for obj in group.objects]] = np.inf
+                if exclude is not None:
+                    distance[exclude[rays, None] == group.indices] = np.inf
+
+                k = np.argmin(distance, axis=1)
+                best = distance[np.arange(len(rays)), k]
+                hit = np.isfinite(best)
+
+                merge(rays[hit], best[hit], group.indices[k[hit]], k[hit])
+
+        # Figuras sin grupo: una por una, como en glCastRays
+        for i in self.others:
+            obj = self.objects[i]
+            if obj == sceneObj:
+                continue
+
+            rays = np.arange(len(dir)) if exclude is None else np.nonzero(exclude != i)[0]
+            distance, objNormal, objTexCoord, hit = obj.ray_intersect_batch(orig[rays], dir[rays])
+
+            rays, closer = merge(rays[hit], distance[hit], i)
+            normal[rays] = objNormal[hit][closer]
+            texCoord[rays] = objTexCoord[hit][closer]
+
+        # Normal y textura solo para la figura ganadora de cada rayo
+        for group in self.groups.values():
+            rays = np.nonzero(np.isin(index, group.indices) & (item >= 0))[0]
+            if len(rays) == 0:
+                continue
+
+            objNormal, objTexCoord = group.Shade(orig[rays], dir[rays], depth[rays], item[rays])
+            normal[rays] = objNormal
+            if objTexCoord is not None:
+                texCoord[rays] = objTexCoord
+
+        return depth, normal, texCoord, index
+
+    def occluder_batch(self, orig, dir, maxDistance = np.inf, sceneObj = None, exclude = None):
+        # Como ray_intersect_batch pero solo busca algun objeto que tape cada
+        # rayo antes de maxDistance (su indice, o -1); los rayos ya tapados
+        # no se prueban contra mas grupos
+        dir = np.asarray(dir, dtype=float)
+        orig = np.broadcast_to(np.asarray(orig, dtype=float), dir.shape)
+        maxDistance = np.broadcast_to(maxDistance, len(dir))
+        occluder = np.full(len(dir), -1)
+
+        for group in self.groups.values():
+            M = len(group.objects)
+            chunk = max(1, MAX_ELEMENTS // (3 * M))
+
+            for start in range(0, len(dir), chunk):
+                rays = np.arange(start, min(start + chunk, len(dir)))
+                rays = rays[occluder[rays] < 0]
+                if len(rays) == 0:
+                    continue
+
+                distance = group.Intersect(orig[rays], dir[rays])
+
+                if sceneObj is not None:
+                    distance[:, [obj is sceneObj for obj in group.objects]] = np.inf
+                if exclude is not None:
+                    distance[exclude[rays, None] == group.indices] = np.inf
+
+                blocked = distance < maxDistance[rays, None]
+                k = np.argmax(blocked, axis=1)
+                hit = blocked[np.arange(len(rays)), k]
+                occluder[rays[hit]] = group.indices[k[hit]]
+
+        for i in self.others:
+            obj = self.objects[i]
+            if obj == sceneObj:
+                continue
+
+            pending = occluder < 0 if exclude is None else (occluder < 0) & (exclude != i)
+            rays = np.nonzero(pending)[0]
+            if len(rays) == 0:
+                continue
+
+            distance, _, _, hit = obj.ray_intersect_batch(orig[rays], dir[rays])
+            occluder[rays[hit & (distance < maxDistance[rays])]] = i
+
+        return occluder
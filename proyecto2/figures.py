@@ -2,15 +2,47 @@ import numpy as np
 from intercept import Intercept
 from math import acos, atan2, pi
 
+
+# Las versiones por lotes de ray_intersect reciben arreglos (N,3) de origenes
+# y direcciones (un solo origen (3,) se replica para todos los rayos) y
+# devuelven, por rayo: distancia (inf si no hay impacto), normal (N,3),
+# coordenadas de textura (N,2) (NaN si la figura no tiene) y mascara de impacto.
+
+def rays_as_arrays(orig, dir):
+    orig = np.atleast_2d(np.asarray(orig, dtype=float))
+    dir = np.atleast_2d(np.asarray(dir, dtype=float))
+    return np.broadcast_arrays(orig, dir)
+
+def batch_result(distance, normal, texCoord, hit):
+    distance = np.where(hit, distance, np.inf)
+    normal = np.where(hit[:, None], normal, 0.0)
+    if texCoord is None:
+        texCoord = np.full((len(hit), 2), np.nan)
+    else:
+        texCoord = np.where(hit[:, None], texCoord, np.nan)
+    return distance, normal, texCoord, hit
+
+def no_hits(n):
+    return np.full(n, np.inf), np.zeros((n, 3)), np.full((n, 2), np.nan), np.zeros(n, dtype=bool)
+
+
 class Shape(object):
     def __init__(self, position, material):
         self.position = position
         self.material = material
         self.type = 'None'
 
+    def GetBounds(self):
+        # Caja envolvente (minimo, maximo) o None si la figura no es acotada
+        return None
+
     def ray_intersect(self, orig, dir):
         return None
 
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+        return no_hits(len(dir))
+
 
 class Sphere(Shape):
     def __init__(self, position, radius, material):
@@ -18,6 +50,10 @@ class Sphere(Shape):
         self.radius = radius
         self.type = 'Sphere'
 
+    def GetBounds(self):
+        position = np.asarray(self.position, dtype=float)
+        return position - self.radius, position + self.radius
+
     def ray_intersect(self, orig, dir):
 
         L = np.subtract(self.position, orig)
@@ -53,6 +89,29 @@ class Sphere(Shape):
             rayDirection=dir,
             texCoord = [u,v]
         )
+
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+
+        L = np.subtract(self.position, orig)
+        tca = np.einsum('ij,ij->i', L, dir)
+        d2 = np.einsum('ij,ij->i', L, L) - tca ** 2
+
+        hit = d2 <= self.radius ** 2
+        thc = np.sqrt(np.maximum(self.radius ** 2 - d2, 0))
+
+        distance = tca - thc
+        distance = np.where(distance < 0, tca + thc, distance)
+        hit &= distance >= 0
+
+        point = orig + dir * distance[:, None]
+        normal = point - np.asarray(self.position, dtype=float)
+        normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+
+        u = -np.arctan2(normal[:, 2], normal[:, 0]) / (2 * pi) + 0.5
+        v = np.arccos(np.clip(-normal[:, 1], -1, 1)) / pi
+
+        return batch_result(distance, normal, np.stack((u, v), axis=1), hit)
     
 class Plane(Shape):
     def __init__(self, position, normal, material):
@@ -82,6 +141,18 @@ class Plane(Shape):
             texCoord=None
         )
 
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+
+        denom = dir @ self.normal
+        hit = np.abs(denom) >= 1e-6
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (np.subtract(self.position, orig) @ self.normal) / denom
+        hit &= t >= 0
+
+        return batch_result(t, np.broadcast_to(self.normal, dir.shape), None, hit)
+
     
 class Disk(Plane):
     def __init__(self, position, normal, radius, material):
@@ -89,6 +160,11 @@ class Disk(Plane):
         self.radius = radius
         self.type = 'Disk'
 
+    def GetBounds(self):
+        extent = self.radius * np.sqrt(np.maximum(0, 1 - self.normal ** 2))
+        position = np.asarray(self.position, dtype=float)
+        return position - extent, position + extent
+
     def ray_intersect(self, orig, dir):
         plane_hit = super().ray_intersect(orig, dir)
         if plane_hit is None:
@@ -106,6 +182,15 @@ class Disk(Plane):
                 texCoord=None
             )
         return None
+
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+        distance, normal, texCoord, hit = super().ray_intersect_batch(orig, dir)
+
+        v = orig + dir * np.where(hit, distance, 0)[:, None] - self.position
+        hit &= np.einsum('ij,ij->i', v, v) <= self.radius * self.radius
+
+        return batch_result(distance, normal, None, hit)
         
     
 class AABB(Shape):
@@ -117,6 +202,9 @@ class AABB(Shape):
         self.max_bound = self.position + half
         self.type = 'AABB'
 
+    def GetBounds(self):
+        return self.min_bound, self.max_bound
+
     def ray_intersect(self, orig, dir):
         orig = np.array(orig, dtype=float)
         dir = np.array(dir, dtype=float)
@@ -124,11 +212,11 @@ class AABB(Shape):
         invdir = 1.0 / dir
         sign = [invdir[i] < 0 for i in range(3)]
 
-        tmin = (self.max_bound[0] if sign[0] else self.min_bound[0] - orig[0]) * invdir[0]
-        tmax = (self.min_bound[0] if sign[0] else self.max_bound[0] - orig[0]) * invdir[0]
+        tmin = ((self.max_bound[0] if sign[0] else self.min_bound[0]) - orig[0]) * invdir[0]
+        tmax = ((self.min_bound[0] if sign[0] else self.max_bound[0]) - orig[0]) * invdir[0]
 
-        tymin = (self.max_bound[1] if sign[1] else self.min_bound[1] - orig[1]) * invdir[1]
-        tymax = (self.min_bound[1] if sign[1] else self.max_bound[1] - orig[1]) * invdir[1]
+        tymin = ((self.max_bound[1] if sign[1] else self.min_bound[1]) - orig[1]) * invdir[1]
+        tymax = ((self.min_bound[1] if sign[1] else self.max_bound[1]) - orig[1]) * invdir[1]
 
         if (tmin > tymax) or (tymin > tmax):
             return None
@@ -138,8 +226,8 @@ class AABB(Shape):
         if tymax < tmax:
             tmax = tymax
 
-        tzmin = (self.max_bound[2] if sign[2] else self.min_bound[2] - orig[2]) * invdir[2]
-        tzmax = (self.min_bound[2] if sign[2] else self.max_bound[2] - orig[2]) * invdir[2]
+        tzmin = ((self.max_bound[2] if sign[2] else self.min_bound[2]) - orig[2]) * invdir[2]
+        tzmax = ((self.min_bound[2] if sign[2] else self.max_bound[2]) - orig[2]) * invdir[2]
 
         if (tmin > tzmax) or (tzmin > tmax):
             return None
@@ -173,6 +261,28 @@ class AABB(Shape):
             texCoord=None
         )
 
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            invdir = 1.0 / dir
+            t0 = (self.min_bound - orig) * invdir
+            t1 = (self.max_bound - orig) * invdir
+
+            tmin = np.nanmax(np.minimum(t0, t1), axis=1)
+            tmax = np.nanmin(np.maximum(t0, t1), axis=1)
+
+        hit = (tmin <= tmax) & (tmax >= 0)
+        distance = np.where(tmin > 0, tmin, tmax)
+
+        point = orig + dir * np.where(hit, distance, 0)[:, None]
+
+        epsilon = 1e-6
+        normal = np.where(np.abs(point - self.min_bound) < epsilon, -1.0, 0.0)
+        normal = np.where((normal == 0) & (np.abs(point - self.max_bound) < epsilon), 1.0, normal)
+
+        return batch_result(distance, normal, None, hit)
+
 class Triangle(Shape):
     def __init__(self, v0, v1, v2, material):
         super().__init__(v0, material)
@@ -186,6 +296,10 @@ class Triangle(Shape):
         self.normal = np.cross(e1, e2)
         self.normal /= np.linalg.norm(self.normal)
 
+    def GetBounds(self):
+        vertices = np.array([self.v0, self.v1, self.v2])
+        return vertices.min(axis=0), vertices.max(axis=0)
+
     def ray_intersect(self, orig, dir):
         orig = np.array(orig, dtype=float)
         dir = np.array(dir, dtype=float)
@@ -222,6 +336,31 @@ class Triangle(Shape):
                 texCoord=None
             )
         return None
+
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+
+        EPSILON = 1e-6
+        e1 = self.v1 - self.v0
+        e2 = self.v2 - self.v0
+        h = np.cross(dir, e2)
+        a = h @ e1
+
+        hit = np.abs(a) >= EPSILON
+        f = 1.0 / np.where(hit, a, 1.0)
+
+        s = orig - self.v0
+        u = f * np.einsum('ij,ij->i', s, h)
+        hit &= (u >= 0.0) & (u <= 1.0)
+
+        q = np.cross(s, e1)
+        v = f * np.einsum('ij,ij->i', dir, q)
+        hit &= (v >= 0.0) & ((u + v) <= 1.0)
+
+        t = f * (q @ e2)
+        hit &= t > EPSILON
+
+        return batch_result(t, np.broadcast_to(self.normal, dir.shape), None, hit)
     
 class Cylinder(Shape):
     def __init__(self, position, radius, height, material):
@@ -234,6 +373,10 @@ class Cylinder(Shape):
         top_center = self.position + np.array([0, self.height, 0])
         self.top_cap = Disk(top_center, [0, 1, 0], radius, material)
 
+    def GetBounds(self):
+        return (self.position - [self.radius, 0, self.radius],
+                self.position + [self.radius, self.height, self.radius])
+
     def ray_intersect(self, orig, dir):
         orig = np.array(orig, dtype=float)
         dir = np.array(dir, dtype=float)
@@ -298,12 +441,65 @@ class Cylinder(Shape):
             texCoord=[u, v]
         )
 
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+        oc = orig - self.position
+
+        a = dir[:, 0]**2 + dir[:, 2]**2
+        b = 2.0 * (oc[:, 0]*dir[:, 0] + oc[:, 2]*dir[:, 2])
+        c = oc[:, 0]**2 + oc[:, 2]**2 - self.radius**2
+
+        EPS = 1e-6
+        disc = b*b - 4*a*c
+        valid = (np.abs(a) > EPS) & (disc >= -EPS)
+        sqrt_disc = np.sqrt(np.maximum(disc, 0.0))
+        a2 = np.where(valid, 2*a, 1.0)
+
+        def lateral(t):
+            y_local = oc[:, 1] + t*dir[:, 1]
+            return valid & (t > EPS) & (y_local >= 0) & (y_local <= self.height)
+
+        t0 = (-b - sqrt_disc) / a2
+        t1 = (-b + sqrt_disc) / a2
+        t_lateral = np.where(lateral(t0), t0, np.where(lateral(t1), t1, np.inf))
+
+        t_bottom, n_bottom, _, _ = self.bottom_cap.ray_intersect_batch(orig, dir)
+        t_top, n_top, _, _ = self.top_cap.ray_intersect_batch(orig, dir)
+
+        # 0 = lateral, 1 = tapa inferior, 2 = tapa superior
+        candidates = np.stack((t_lateral, t_bottom, t_top), axis=1)
+        tag = np.argmin(candidates, axis=1)
+        t = candidates[np.arange(len(tag)), tag]
+        hit = np.isfinite(t)
+
+        point = orig + dir * np.where(hit, t, 0)[:, None]
+        local = point - self.position
+
+        normal = local * [1, 0, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normal /= np.linalg.norm(normal, axis=1, keepdims=True)
+        normal = np.where((tag == 1)[:, None], n_bottom, normal)
+        normal = np.where((tag == 2)[:, None], n_top, normal)
+
+        theta = -np.arctan2(local[:, 2], local[:, 0])
+        rho = (local[:, 0]**2 + local[:, 2]**2) ** 0.5 / self.radius
+        u = (theta / (2 * pi)) + 0.5
+        v = np.where(tag == 0, local[:, 1] / self.height, rho)
+
+        u = u - np.floor(u)
+        v = np.clip(v, 0.0, 1.0)
+
+        return batch_result(t, normal, np.stack((u, v), axis=1), hit)
+
 class Ellipsoid(Shape):
     def __init__(self, position, radius, material):
         super().__init__(np.array(position, dtype=float), material)
         self.radius = np.array(radius, dtype=float)
         self.type = "Ellipsoid"
 
+    def GetBounds(self):
+        return self.position - self.radius, self.position + self.radius
+
     def ray_intersect(self, orig, dir):
         EPS = 1e-6
         orig = np.array(orig, dtype=float)
@@ -349,6 +545,35 @@ class Ellipsoid(Shape):
             texCoord=None
         )
 
+    def ray_intersect_batch(self, orig, dir):
+        EPS = 1e-6
+        orig, dir = rays_as_arrays(orig, dir)
+
+        o = (orig - self.position) / self.radius
+        d = dir / self.radius
+
+        A = np.einsum('ij,ij->i', d, d)
+        B = 2 * np.einsum('ij,ij->i', o, d)
+        C = np.einsum('ij,ij->i', o, o) - 1
+
+        disc = B*B - 4*A*C
+        sqrt_disc = np.sqrt(np.maximum(disc, 0))
+        t0 = (-B - sqrt_disc) / (2*A)
+        t1 = (-B + sqrt_disc) / (2*A)
+
+        t = np.where(t0 > EPS, t0, t1)
+        hit = (disc >= 0) & (t > EPS)
+
+        point = orig + dir * np.where(hit, t, 0)[:, None]
+
+        local = (point - self.position) / (self.radius * self.radius)
+        normal = local / np.linalg.norm(local, axis=1, keepdims=True)
+
+        flip = np.einsum('ij,ij->i', normal, dir) > 0
+        normal[flip] *= -1
+
+        return batch_result(t, normal, None, hit)
+
 class Cone(Shape):
     def __init__(self, position, radius, height, material):
         super().__init__(np.array(position, dtype=float), material)
@@ -360,6 +585,10 @@ class Cone(Shape):
         self.k = self.radius / self.height
         self.k2 = self.k * self.k
 
+    def GetBounds(self):
+        return (self.position - [self.radius, 0, self.radius],
+                self.position + [self.radius, self.height, self.radius])
+
     def ray_intersect(self, orig, dir):
         orig = np.array(orig, dtype=float)
         dir  = np.array(dir, dtype=float)
@@ -409,6 +638,44 @@ class Cone(Shape):
             texCoord=None
         )
 
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+        EPS  = 1e-6
+
+        o = orig - self.apex
+        d = dir
+
+        A = d[:, 0]*d[:, 0] + d[:, 2]*d[:, 2] - self.k2 * d[:, 1]*d[:, 1]
+        B = 2.0 * (o[:, 0]*d[:, 0] + o[:, 2]*d[:, 2] - self.k2 * o[:, 1]*d[:, 1])
+        C = o[:, 0]*o[:, 0] + o[:, 2]*o[:, 2] - self.k2 * o[:, 1]*o[:, 1]
+
+        disc = B*B - 4.0*A*C
+        valid = (np.abs(A) > EPS) & (disc >= -EPS)
+        sqrt_disc = np.sqrt(np.maximum(0.0, disc))
+        A2 = np.where(valid, 2.0*A, 1.0)
+
+        def lateral(t):
+            y_local = o[:, 1] + t * d[:, 1]
+            hit = valid & (t > EPS) & (y_local >= -self.height) & (y_local <= 0.0)
+            return np.where(hit, t, np.inf)
+
+        t_lateral = np.minimum(lateral((-B - sqrt_disc) / A2), lateral((-B + sqrt_disc) / A2))
+        t_base, n_base, _, _ = self.base.ray_intersect_batch(orig, dir)
+
+        base = t_base < t_lateral
+        t = np.where(base, t_base, t_lateral)
+        hit = np.isfinite(t)
+
+        lp = orig + dir * np.where(hit, t, 0)[:, None] - self.apex
+        normal = np.stack((lp[:, 0], -self.k2 * lp[:, 1], lp[:, 2]), axis=1)
+        nlen = np.linalg.norm(normal, axis=1, keepdims=True)
+        normal = np.divide(normal, nlen, out=normal, where=nlen > 0)
+        flip = np.einsum('ij,ij->i', normal, dir) > 0
+        normal[flip] *= -1
+        normal = np.where(base[:, None], n_base, normal)
+
+        return batch_result(t, normal, None, hit)
+
 class Torus(Shape):
     def __init__(self, position, major_radius, minor_radius, material):
         super().__init__(np.array(position, dtype=float), material)
@@ -416,6 +683,10 @@ class Torus(Shape):
         self.r = float(minor_radius)
         self.type = "Torus"
 
+    def GetBounds(self):
+        extent = np.array([self.R + self.r, self.r, self.R + self.r])
+        return self.position - extent, self.position + extent
+
     def ray_intersect(self, orig, dir):
         EPS = 1e-6
         o = np.array(orig, dtype=float) - self.position
@@ -473,3 +744,61 @@ class Torus(Shape):
             rayDirection=dir,
             texCoord=None
         )
+
+    def ray_intersect_batch(self, orig, dir):
+        EPS = 1e-6
+        orig, dir = rays_as_arrays(orig, dir)
+        distance, normal, texCoord, hit = no_hits(len(dir))
+
+        o = orig - self.position
+        dd = np.einsum('ij,ij->i', dir, dir)
+        oo = np.einsum('ij,ij->i', o, o)
+        od = np.einsum('ij,ij->i', o, dir)
+
+        # Solo se resuelve la cuartica para los rayos que tocan la esfera envolvente
+        bound2 = (self.R + self.r) ** 2
+        candidates = (oo - od*od/dd <= bound2) & ((od <= 0) | (oo <= bound2))
+        idx = np.nonzero(candidates)[0]
+        if len(idx) == 0:
+            return distance, normal, texCoord, hit
+
+        o, d = o[idx], dir[idx]
+        dd, oo, od = dd[idx], oo[idx], od[idx]
+
+        R2 = self.R * self.R
+        r2 = self.r * self.r
+
+        k = oo - r2 - R2
+        fourR2 = 4.0 * R2
+
+        A = dd*dd
+        B = 4.0 * dd * od
+        C = 2.0*dd*k + 4.0*od*od + fourR2*(d[:, 1]*d[:, 1])
+        D = 4.0*od*k + 2.0*fourR2*(o[:, 1]*d[:, 1])
+        E = k*k + fourR2*(o[:, 1]*o[:, 1] - r2)
+
+        # Raices como valores propios de la matriz compañera, igual que np.roots
+        companion = np.zeros((len(idx), 4, 4))
+        companion[:, 0, :] = -np.stack((B, C, D, E), axis=1) / A[:, None]
+        companion[:, 1, 0] = companion[:, 2, 1] = companion[:, 3, 2] = 1
+        roots = np.linalg.eigvals(companion)
+
+        valid = (np.abs(roots.imag) < 1e-6) & (roots.real > EPS)
+        t = np.where(valid, roots.real, np.inf).min(axis=1)
+
+        p = o + d * np.where(np.isfinite(t), t, 0)[:, None]
+        px, py, pz = p[:, 0], p[:, 1], p[:, 2]
+
+        sumsq = px*px + py*py + pz*pz
+        g = sumsq + R2 - r2
+        n = np.stack((4.0*g*px - 8.0*R2*px, 4.0*g*py, 4.0*g*pz - 8.0*R2*pz), axis=1)
+        nlen = np.linalg.norm(n, axis=1, keepdims=True)
+        n = np.divide(n, nlen, out=n, where=nlen > 0)
+        flip = np.einsum('ij,ij->i', n, d) > 0
+        n[flip] *= -1
+
+        hit[idx] = np.isfinite(t) & (nlen[:, 0] > 0)
+        distance[idx] = t
+        normal[idx] = n
+
+        return batch_result(distance, normal, None, hit)
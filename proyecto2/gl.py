@@ -1,16 +1,44 @@
 import numpy as np
 from math import isclose, floor, ceil, pi, tan, atan2, acos
 from camera import Camera
+from figures import no_hits
+from intercept import Intercept
+from bvh import SceneBVH
+from compiled import CompiledScene
+from parallel import RenderTilesParallel
+from progressive import RenderProgressive
+from preview import PreviewRenderer
+from sharedmem import SharedArray
+from wavefront import TraceWavefront, MaterialTable
+from shadows import ShadowCache
+from lights import LightGrid
 
 import pygame
 import random
+import time
+
+# Politicas para mostrar el render en pantalla (presentMode)
+PRESENT_NEVER = 0   # render por lotes, sin tocar la pantalla
+PRESENT_PIXELS = 1  # cada presentInterval pixeles
+PRESENT_TIME = 2    # cada presentInterval milisegundos
+PRESENT_TILE = 3    # al terminar cada tile
 
 class Renderer(object):
-    def __init__(self, screen):
+    def __init__(self, screen = None, width = None, height = None):
+        # Sin screen el Renderer es headless: solo escribe en el frameBuffer
         self.screen = screen
-        _, _, self.width, self.height = self.screen.get_rect()
+
+        if self.screen:
+            _, _, self.width, self.height = self.screen.get_rect()
+        else:
+            self.width = width
+            self.height = height
 
         self.camera = Camera()
+
+        # Ejes de la camara en el mundo; se calculan una vez por frame en
+        # glPrepareScene y rotan todos los rayos primarios en un solo producto
+        self.cameraBasis = np.eye(3)
         self.glViewport(0, 0, self.width, self.height)
         self.glProjection()
 
@@ -22,21 +50,73 @@ class Renderer(object):
         self.scene = []
         self.lights = []
 
+        self.useBVH = True
+        self.bvh = None
+
+        # Sin BVH, las figuras se prueban por grupos empacados del mismo tipo
+        self.compiledScene = None
+
+        # Ultimo objeto que tapo cada luz; se reinicia en cada tile
+        self.shadowCache = ShadowCache()
+
+        # Materiales de la escena e indice del material de cada objeto, para
+        # agrupar los impactos de cada frente de onda
+        self.materialTable = None
+
+        # Solo se evaluan las luces cuyo radio o cono alcanza cada punto
+        self.useLightCulling = True
+        self.lightGrid = None
+
+        self.tileSize = 32
+
+        # Mas de un proceso reparte los tiles en un Pool (None = todos los nucleos)
+        self.processes = 1
+
+        self.presentMode = PRESENT_TIME if self.screen else PRESENT_NEVER
+        self.presentInterval = 33
+        self.presentPending = 0
+        self.lastPresent = time.perf_counter()
+
         self.envMap = None
 
         self.maxRecursionDepth = 3
 
+        # Los rayos secundarios que aportan menos que minThroughput al pixel
+        # no se trazan. Con russianRoulette, desde rouletteDepth cada rayo
+        # sobrevive con probabilidad igual a su aporte y se escala para
+        # compensar; seed fija los numeros aleatorios de cada tile.
+        self.minThroughput = 1 / 256
+        self.russianRoulette = False
+        self.rouletteDepth = 2
+        self.seed = 0
+        self.tileRandom = np.random.default_rng(self.seed)
+
+        # Sombrear por frentes de onda en lotes en lugar de la recursion
+        # de Material.GetSurfaceColor
+        self.useWavefront = True
+
     
+    def __getstate__(self):
+        # Lo que se envia a los procesos del Pool: la pantalla de pygame no
+        # se puede serializar y el frameBuffer solo viaja si esta en memoria
+        # compartida
+        state = self.__dict__.copy()
+        state['screen'] = None
+        if not isinstance(self.frameBuffer, SharedArray):
+            state['frameBuffer'] = None
+        state['presentMode'] = PRESENT_NEVER
+        return state
+
     def glViewport(self, x, y, width, height):
         self.vpX = round(x)
         self.vpY = round(y)
         self.vpWidth = width
         self.vpHeight = height
 
-        self.viewportMatrix = np.matrix([[width/2, 0, 0,x + width/2],
-                                         [0, height/2, 0, y + height/2],
-                                         [0, 0, 0.5, 0.5],
-                                         [0, 0, 0, 1]])
+        self.viewportMatrix = np.array([[width/2, 0, 0,x + width/2],
+                                        [0, height/2, 0, y + height/2],
+                                        [0, 0, 0.5, 0.5],
+                                        [0, 0, 0, 1]])
     
     def glProjection(self, n = 0.1, f = 1000, fov = 60):
         aspectRatio = self.vpWidth / self.vpHeight
@@ -46,10 +126,10 @@ class Renderer(object):
 
         self.nearPlane = n
 
-        self.projectionMatrix = np.matrix([[n/self.rightEdge, 0, 0, 0],
-                                           [0, n/self.topEdge, 0, 0],
-                                           [0, 0, -(f+n)/(f-n), -(2*f*n)/(f-n)],
-                                           [0, 0, -1, 0]])
+        self.projectionMatrix = np.array([[n/self.rightEdge, 0, 0, 0],
+                                          [0, n/self.topEdge, 0, 0],
+                                          [0, 0, -(f+n)/(f-n), -(2*f*n)/(f-n)],
+                                          [0, 0, -1, 0]])
     
     def glClearColor(self, r, g, b):
         # 0 - 1
@@ -75,13 +155,47 @@ class Renderer(object):
             return self.envMap.getColor(x, y)
 
         return self.clearColor
+
+    def glEnvMapColors(self, orig, dirs):
+        # Version por lotes de glEnvMapColor para direcciones (N,3)
+        if self.envMap:
+            x = np.arctan2(dirs[:, 2], dirs[:, 0])/(2 * pi) + 0.5
+            y = np.arccos(np.clip(-dirs[:, 1], -1, 1))/pi
+
+            return self.envMap.getColors(x, y)
+
+        return np.broadcast_to(self.clearColor, np.shape(dirs))
     
     def glClear(self):
-        color = [int(i * 255) for i in self.clearColor]
-        self.screen.fill(color)
-        
-        self.frameBuffer = [[color for y in range(self.height)]
-							for x in range(self.width)]
+        # frameBuffer es un arreglo (alto, ancho, 3) de floats; la fila 0 es
+        # la inferior, igual que en un BMP
+        self.frameBuffer = np.empty((self.height, self.width, 3), dtype = np.float32)
+        self.frameBuffer[:] = self.clearColor
+
+        if self.screen:
+            self.screen.fill([int(i * 255) for i in self.clearColor])
+
+    def glFrameBufferBytes(self, x0 = 0, y0 = 0, x1 = None, y1 = None):
+        # Region del frameBuffer convertida a colores de 8 bits (0 - 255)
+        region = self.frameBuffer[y0:y1, x0:x1]
+        return (np.clip(region, 0, 1) * 255).astype(np.uint8)
+
+    def glBlit(self, x0 = 0, y0 = 0, x1 = None, y1 = None):
+        # Copia una region del frameBuffer a la pantalla en una sola operacion
+        if not self.screen:
+            return
+
+        x0, y0 = max(0, x0), max(0, y0)
+        x1 = self.width if x1 is None else min(x1, self.width)
+        y1 = self.height if y1 is None else min(y1, self.height)
+
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        # Pygame usa (x, y) con la Y hacia abajo
+        pixels = pygame.surfarray.pixels3d(self.screen)
+        pixels[x0:x1, self.height - y1:self.height - y0] = self.glFrameBufferBytes(x0, y0, x1, y1)[::-1].swapaxes(0, 1)
+        del pixels
     
     def glPoint(self, x, y, color = None):
         # Pygame empieza a renderizar desde la esquina
@@ -91,11 +205,12 @@ class Renderer(object):
         y = round(y)
         
         if (0 <= x < self.width) and (0 <= y < self.height):
-            color = [int(i * 255) for i in (color or self.currColor) ]
+            color = color or self.currColor
 
-            self.screen.set_at((x,self.height - 1 - y ), color)
+            self.frameBuffer[y, x] = color
 
-            self.frameBuffer[x][y] = color
+            if self.screen:
+                self.screen.set_at((x,self.height - 1 - y ), self.glFrameBufferBytes(x, y, x + 1, y + 1)[0, 0])
     
     def glLine(self, p0, p1, color = None):
         		# Algoritmo de Lineas de Bresenham
@@ -148,45 +263,244 @@ class Renderer(object):
 
                 limit += 1
     
-    def glRender(self):
+    def glPrimaryRays(self):
+        # Direcciones de todos los rayos primarios del viewport en una sola
+        # pasada, como un arreglo (alto, ancho, 3). La fila j corresponde a
+        # y = vpY + j y la columna i a x = vpX + i.
 
-        indeces = [(i, j) for i in range(self.vpWidth) for j in range(self.vpHeight)]
-        random.shuffle(indeces)
+        pX = ((np.arange(self.vpWidth) + 0.5) / self.vpWidth) * 2 - 1
+        pY = ((np.arange(self.vpHeight) + 0.5) / self.vpHeight) * 2 - 1
 
-        for i, j in indeces:
-            x = i + self.vpX
-            y = j + self.vpY
+        rays = np.empty((self.vpHeight, self.vpWidth, 3))
+        rays[:, :, 0] = pX * self.rightEdge
+        rays[:, :, 1] = (pY * self.topEdge)[:, None]
+        rays[:, :, 2] = -self.nearPlane
 
-            if 0 <= x < self.width and 0 <= y < self.height:
+        rays /= np.linalg.norm(rays, axis = 2, keepdims = True)
 
-                pX = ((x + 0.5 - self.vpX) / self.vpWidth) * 2 - 1
-                pY = ((y + 0.5 - self.vpY) / self.vpHeight) * 2 - 1 
+        return rays @ self.cameraBasis.T
 
-                pX *= self.rightEdge
-                pY *= self.topEdge
-                pZ = -self.nearPlane
+    def glPixelRays(self, x, y):
+        # Direcciones de rayos por puntos arbitrarios del viewport: x, y son
+        # arreglos de coordenadas del viewport (x + 0.5 es el centro del pixel)
 
-                dir = [pX, pY, pZ]
-                dir /= np.linalg.norm(dir)
+        rays = np.empty((len(x), 3))
+        rays[:, 0] = ((np.asarray(x) / self.vpWidth) * 2 - 1) * self.rightEdge
+        rays[:, 1] = ((np.asarray(y) / self.vpHeight) * 2 - 1) * self.topEdge
+        rays[:, 2] = -self.nearPlane
 
-                hit = self.glCastRay(self.camera.translation, dir)
+        rays /= np.linalg.norm(rays, axis = 1, keepdims = True)
 
-                color = [0,0,0]
+        return rays @ self.cameraBasis.T
 
-                if hit != None:
-                    if hit.obj.material:
-                        color = hit.obj.material.GetSurfaceColor(hit, self)
-                else:
-                    color = self.glEnvMapColor(self.camera.translation, dir)
+    def glBuildBVH(self):
+        # Reconstruir cada vez que cambie self.scene
+        self.bvh = SceneBVH(self.scene)
+
+    def glBuildMaterialTable(self):
+        # Reconstruir cada vez que cambie self.scene o el material de un objeto
+        self.materialTable = MaterialTable(self.scene)
+
+    def glBuildLightGrid(self):
+        # Reconstruir cada vez que cambie self.lights
+        self.lightGrid = LightGrid(self.lights)
+
+    def glLightsAt(self, point):
+        if self.lightGrid:
+            return self.lightGrid.GetLights(point)
+        return self.lights
+
+    def glLightsForPoints(self, points):
+        # Pares (luz, indices de los puntos en los que puede aportar)
+        if self.lightGrid:
+            return self.lightGrid.GetLightsForPoints(points)
+        return [(light, np.arange(len(points))) for light in self.lights]
+
+    def glCompileScene(self):
+        # Agrupa y empaca la escena por tipo de figura; reconstruir cada vez
+        # que cambie self.scene o alguna de sus figuras
+        if self.compiledScene:
+            self.compiledScene.Update(self.scene)
+        else:
+            self.compiledScene = CompiledScene(self.scene)
+
+    def glPresent(self):
+        if self.screen:
+            pygame.display.flip()
+
+        self.presentPending = 0
+        self.lastPresent = time.perf_counter()
+
+    def glPresentUpdate(self, pixels = 1, tileDone = False):
+        # Muestra el frame solo cuando la politica de presentMode lo pide
+
+        if self.presentMode == PRESENT_NEVER:
+            return
+
+        self.presentPending += pixels
+
+        if self.presentMode == PRESENT_PIXELS:
+            if self.presentPending >= self.presentInterval:
+                self.glPresent()
+
+        elif self.presentMode == PRESENT_TIME:
+            if (time.perf_counter() - self.lastPresent) * 1000 >= self.presentInterval:
+                self.glPresent()
+
+        elif self.presentMode == PRESENT_TILE:
+            if tileDone:
+                self.glPresent()
+
+    def glTiles(self):
+        # Divide el viewport en tiles (x0, y0, x1, y1), en coordenadas del viewport
+        return [(i, j, min(i + self.tileSize, self.vpWidth), min(j + self.tileSize, self.vpHeight))
+                for j in range(0, self.vpHeight, self.tileSize)
+                for i in range(0, self.vpWidth, self.tileSize)]
+
+    def glVisibleViewport(self):
+        # Parte del viewport que cae dentro de la pantalla, (x0, y0, x1, y1)
+        # en coordenadas del viewport; vacia si x0 >= x1 o y0 >= y1
+        return (max(0, -self.vpX), max(0, -self.vpY),
+                min(self.vpWidth, self.width - self.vpX), min(self.vpHeight, self.height - self.vpY))
+
+    def glBeginBatch(self, *seedKey):
+        # Estado por lote de rayos primarios: un cache de sombras nuevo y
+        # numeros aleatorios que dependen solo de seed y seedKey
+        self.shadowCache = ShadowCache()
+        self.tileRandom = np.random.default_rng((self.seed,) + seedKey)
+
+    def glShadeTile(self, tile, rays = None):
+        # Calcula los colores de un tile sin escribirlos. Devuelve la region
+        # (x0, y0, x1, y1) en coordenadas de pantalla que cae dentro de la
+        # pantalla y sus colores (alto, ancho, 3), o None si queda fuera.
+        # Sin rays (los de glPrimaryRays) se generan solo los del tile.
+
+        x0, y0, x1, y1 = tile
+        vx0, vy0, vx1, vy1 = self.glVisibleViewport()
+
+        x0, x1 = max(x0, vx0), min(x1, vx1)
+        y0, y1 = max(y0, vy0), min(y1, vy1)
+
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        # Depende solo del tile, asi el resultado no cambia con el orden ni
+        # con el proceso que lo renderice
+        self.glBeginBatch(x0, y0)
+
+        if rays is None:
+            ys, xs = np.mgrid[y0:y1, x0:x1]
+            dirs = self.glPixelRays(xs.ravel() + 0.5, ys.ravel() + 0.5)
+        else:
+            dirs = rays[y0:y1, x0:x1].reshape(-1, 3)
+        orig = np.asarray(self.camera.translation, dtype = float)
+        region = (x0 + self.vpX, y0 + self.vpY, x1 + self.vpX, y1 + self.vpY)
+
+        colors = self.glTraceRays(orig, dirs)
+        return region, colors.reshape(y1 - y0, x1 - x0, 3)
+
+    def glTraceRays(self, orig, dirs):
+        # Color (N,3) de cada rayo primario que sale de orig en las
+        # direcciones dirs (N,3)
+
+        if self.useWavefront:
+            return TraceWavefront(self, orig, dirs)
+
+        colors = np.zeros(dirs.shape)
+
+        # Visibilidad primaria de todos los rayos en una sola consulta
+        depth, normal, texCoord, index = self.glCastRays(orig, dirs)
+
+        miss = index < 0
+        colors[miss] = self.glEnvMapColors(orig, dirs[miss])
 
-                self.glPoint(x, y, color)
-                pygame.display.flip()
+        for k in np.nonzero(~miss)[0]:
+            obj = self.scene[index[k]]
+            if obj.material:
+                hit = Intercept(point = orig + dirs[k] * depth[k],
+                                normal = normal[k],
+                                distance = depth[k],
+                                obj = obj,
+                                rayDirection = dirs[k],
+                                texCoord = None if np.isnan(texCoord[k, 0]) else list(texCoord[k]))
+                colors[k] = obj.material.GetSurfaceColor(hit, self)
+
+        return colors
+
+    def glWriteTile(self, region, colors = None):
+        # Sin colores, el tile ya esta escrito en el frameBuffer (por ejemplo
+        # desde otro proceso a traves de memoria compartida)
+        x0, y0, x1, y1 = region
+
+        if colors is not None:
+            self.frameBuffer[y0:y1, x0:x1] = colors
+
+        self.glBlit(x0, y0, x1, y1)
+        self.glPresentUpdate((x1 - x0) * (y1 - y0))
+
+    def glRenderTile(self, tile, rays):
+        result = self.glShadeTile(tile, rays)
+
+        if result:
+            self.glWriteTile(*result)
+
+        self.glPresentUpdate(0, tileDone = True)
+
+    def glPrepareScene(self):
+        # Estructuras de aceleracion que dependen de la escena y las luces,
+        # y la orientacion de la camara para este frame
+        self.cameraBasis = self.camera.GetBasis()
+
+        if self.useBVH:
+            self.glBuildBVH()
+        else:
+            # glCastRays y glOccluderRays prueban primero el BVH; uno viejo
+            # seria de otra escena
+            self.bvh = None
+            self.glCompileScene()
+
+        self.glBuildMaterialTable()
+
+        self.lightGrid = None
+        if self.useLightCulling:
+            self.glBuildLightGrid()
+
+    def glRender(self):
+
+        self.glPrepareScene()
+
+        tiles = self.glTiles()
+        random.shuffle(tiles)
+
+        if self.processes != 1:
+            # Cada proceso genera solo los rayos de sus tiles
+            RenderTilesParallel(self, tiles, self.processes)
+        else:
+            rays = self.glPrimaryRays()
+            for tile in tiles:
+                self.glRenderTile(tile, rays)
+
+        if self.presentMode != PRESENT_NEVER:
+            self.glPresent()
+
+    def glRenderProgressive(self, maxSamples = 16, minSamples = 4, errorThreshold = 0.01, timeBudget = None):
+        # Varias muestras por pixel acumuladas de forma progresiva; ver
+        # progressive.py. Devuelve cuantas muestras recibio cada pixel.
+        return RenderProgressive(self, maxSamples, minSamples, errorThreshold, timeBudget)
+
+    def glPreview(self, startBlock = 16, frameBudget = 1 / 30):
+        # Vista previa por niveles de resolucion; llamar Update() del objeto
+        # devuelto en cada cuadro. Ver preview.py.
+        return PreviewRenderer(self, startBlock, frameBudget)
 
     def glCastRay(self, origin, direction, sceneObj = None, recursion = 0):
 
         if recursion > self.maxRecursionDepth:
             return None
 
+        if self.bvh:
+            return self.bvh.ray_intersect(origin, direction, sceneObj)
+
         depht = float('inf')
         intercept = None
         hit = None
@@ -199,4 +513,127 @@ class Renderer(object):
                     if intercept.distance < depht:
                         hit = intercept
                         depht = intercept.distance
-        return hit
\ No newline at end of file
+        return hit
+
+    def glCastRays(self, origins, directions, sceneObj = None, exclude = None):
+        # Version por lotes de glCastRay. Devuelve, por rayo, la distancia,
+        # normal y coordenadas de textura del impacto mas cercano y el indice
+        # del objeto en self.scene (-1 si el rayo no toca nada). exclude es
+        # opcional: un indice de self.scene por rayo que ese rayo debe ignorar.
+
+        if self.bvh:
+            return self.bvh.ray_intersect_batch(origins, directions, sceneObj, exclude)
+
+        if self.compiledScene:
+            return self.compiledScene.ray_intersect_batch(origins, directions, sceneObj, exclude)
+
+        origins = np.broadcast_to(np.asarray(origins, dtype = float), np.shape(directions))
+        depth, normal, texCoord, _ = no_hits(len(directions))
+        index = np.full(len(directions), -1)
+
+        for i, obj in enumerate(self.scene):
+            if obj != sceneObj:
+                rays = np.arange(len(directions)) if exclude is None else np.nonzero(exclude != i)[0]
+
+                distance, objNormal, objTexCoord, hit = obj.ray_intersect_batch(origins[rays], directions[rays])
+
+                closer = hit & (distance < depth[rays])
+                rays = rays[closer]
+                depth[rays] = distance[closer]
+                normal[rays] = objNormal[closer]
+                texCoord[rays] = objTexCoord[closer]
+                index[rays] = i
+
+        return depth, normal, texCoord, index
+
+    def glOccluder(self, origin, direction, maxDistance = float('inf'), sceneObj = None):
+        # Sombras: solo importa si algun objeto distinto de sceneObj tapa el
+        # rayo antes de maxDistance, asi que se detiene en el primero.
+        # Devuelve su indice en self.scene o -1.
+
+        if self.bvh:
+            return self.bvh.occluder(origin, direction, maxDistance, sceneObj)
+
+        for i, obj in enumerate(self.scene):
+            if obj != sceneObj:
+                intercept = obj.ray_intersect(origin, direction)
+
+                if intercept != None and intercept.distance < maxDistance:
+                    return i
+
+        return -1
+
+    def glOccluded(self, origin, direction, maxDistance = float('inf'), sceneObj = None):
+        return self.glOccluder(origin, direction, maxDistance, sceneObj) >= 0
+
+    def glOccluderRays(self, origins, directions, maxDistance = np.inf, sceneObj = None, exclude = None):
+        # Version por lotes de glOccluder. maxDistance puede ser un valor por
+        # rayo y exclude un indice de self.scene por rayo, como en glCastRays.
+
+        if self.bvh:
+            return self.bvh.occluder_batch(origins, directions, maxDistance, sceneObj, exclude)
+
+        if self.compiledScene:
+            return self.compiledScene.occluder_batch(origins, directions, maxDistance, sceneObj, exclude)
+
+        origins = np.broadcast_to(np.asarray(origins, dtype = float), np.shape(directions))
+        maxDistance = np.broadcast_to(maxDistance, len(directions))
+        occluder = np.full(len(directions), -1)
+
+        for i, obj in enumerate(self.scene):
+            if obj != sceneObj:
+                pending = occluder < 0 if exclude is None else (occluder < 0) & (exclude != i)
+                rays = np.nonzero(pending)[0]
+
+                distance, _, _, hit = obj.ray_intersect_batch(origins[rays], directions[rays])
+                occluder[rays[hit & (distance < maxDistance[rays])]] = i
+
+        return occluder
+
+    def glOccludedRays(self, origins, directions, maxDistance = np.inf, sceneObj = None, exclude = None):
+        return self.glOccluderRays(origins, directions, maxDistance, sceneObj, exclude) >= 0
+
+    def glShadowed(self, light, point, sceneObj = None):
+        # Si algun objeto tapa la luz vista desde point, sin contar sceneObj
+        ray = light.GetShadowRay(point) if light.castShadows else None
+        if ray is None:
+            return False
+
+        direction, maxDistance = ray
+        return self.shadowCache.Occluded(self, light, point, direction, maxDistance, sceneObj)
+
+    def glShadowedRays(self, light, points, exclude = None):
+        # Version por lotes de glShadowed con un indice de self.scene por punto
+        rays = light.GetShadowRays(points) if light.castShadows else None
+        if rays is None:
+            return np.zeros(len(points), dtype = bool)
+
+        directions, maxDistance = rays
+        return self.glOccludedRays(points, directions, maxDistance, exclude = exclude)
+
+    def glPathWeight(self, throughput, depth):
+        # Factor por el que se escala un rayo secundario de profundidad depth
+        # con el aporte throughput (r, g, b): 0 si no se traza
+        contribution = max(throughput)
+
+        if contribution < self.minThroughput:
+            return 0
+
+        if self.russianRoulette and depth >= self.rouletteDepth and contribution < 1:
+            if self.tileRandom.random() >= contribution:
+                return 0
+            return 1 / contribution
+
+        return 1
+
+    def glPathWeights(self, throughputs, depth):
+        # Version por lotes de glPathWeight para un arreglo (N,3)
+        contribution = np.max(throughputs, axis = 1) if len(throughputs) else np.zeros(0)
+        weights = np.where(contribution < self.minThroughput, 0.0, 1.0)
+
+        if self.russianRoulette and depth >= self.rouletteDepth:
+            roulette = (weights > 0) & (contribution < 1)
+            survive = self.tileRandom.random(len(weights)) < contribution
+            weights[roulette] = np.where(survive[roulette], 1 / contribution[roulette], 0.0)
+
+        return weights
@@ -0,0 +1,85 @@
+import numpy as np
+from figures import Shape, rays_as_arrays, batch_result
+from intercept import Intercept
+
+# Instancia: una figura prototipo (cualquier Shape, una Mesh u otra
+# Instance) colocada en la escena con la transformacion de un Model. Los
+# rayos se llevan al espacio del prototipo en lugar de copiar su geometria,
+# asi muchas instancias comparten la misma malla y su BVH, y el BVH de la
+# escena solo ve las cajas de las instancias.
+
+class Instance(Shape):
+    # Sin material se usa el del prototipo. Si cambia model hay que llamar
+    # Update() para recalcular la transformacion y la caja.
+
+    def __init__(self, prototype, model, material = None):
+        self.prototype = prototype
+        self.model = model
+
+        super().__init__(None, material if material is not None else prototype.material)
+        self.type = 'Instance'
+
+        self.Update()
+
+    def Update(self):
+        # La transformacion viene del cache de poses, asi que las instancias
+        # con la misma pose comparten matriz e inversa
+        self.transform = self.model.GetTransform()
+        self.inverse = self.transform.GetInverse()
+        self.position = self.transform.matrix[:3, 3]
+
+        self.bounds = None
+        box = self.prototype.GetBounds()
+        if box is not None:
+            # Las 8 esquinas de la caja del prototipo en el mundo
+            corners = np.array([[x, y, z] for x in (box[0][0], box[1][0])
+                                          for y in (box[0][1], box[1][1])
+                                          for z in (box[0][2], box[1][2])], dtype=float)
+            corners = self.transform.TransformPoints(corners)
+            self.bounds = corners.min(axis=0), corners.max(axis=0)
+
+    def GetBounds(self):
+        return self.bounds
+
+    def ToObjectSpace(self, orig, dir):
+        # Origenes y direcciones en el espacio del prototipo. La direccion se
+        # normaliza porque las figuras la suponen unitaria; scale convierte
+        # sus distancias de vuelta a distancias del mundo.
+        localOrig = orig @ self.inverse[:3, :3].T + self.inverse[:3, 3]
+        localDir = dir @ self.inverse[:3, :3].T
+        scale = np.linalg.norm(localDir, axis=-1)
+        return localOrig, localDir / np.expand_dims(scale, -1), scale
+
+    def ToWorldNormals(self, normals):
+        normals = self.transform.TransformNormals(normals)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(normals / np.linalg.norm(normals, axis=-1, keepdims=True))
+
+    def ray_intersect(self, orig, dir):
+        orig = np.asarray(orig, dtype=float)
+        dir = np.asarray(dir, dtype=float)
+
+        localOrig, localDir, scale = self.ToObjectSpace(orig, dir)
+        intercept = self.prototype.ray_intersect(localOrig, localDir)
+
+        if intercept is None:
+            return None
+
+        distance = intercept.distance / scale
+
+        return Intercept(
+            point=orig + dir * distance,
+            normal=self.ToWorldNormals(np.asarray(intercept.normal, dtype=float)),
+            distance=distance,
+            obj=self,
+            rayDirection=dir,
+            texCoord=intercept.texCoord
+        )
+
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+
+        localOrig, localDir, scale = self.ToObjectSpace(orig, dir)
+        distance, normal, texCoord, hit = self.prototype.ray_intersect_batch(localOrig, localDir)
+
+        return batch_result(distance / scale, self.ToWorldNormals(normal), texCoord, hit)
@@ -1,18 +1,59 @@
 import numpy as np
-from Mathlib import reflectVector
+from Mathlib import reflectVector, reflectVectorBatch
 from math import pi, cos
 
+# Aporte por debajo del cual una luz puntual ya no se toma en cuenta; de
+# aqui sale su radio de influencia
+INFLUENCE_CUTOFF = 1 / 512
+
 class Light(object):
     def __init__(self, color = [1,1,1], intensity = 1.0, lightType = 'None'):
         self.color = color
         self.intensity = intensity
         self.lightType = lightType
 
+        # Las luces con direccion o posicion lanzan rayos de sombra
+        self.castShadows = True
+
     def GetLightColor(self, intercept = None):
         return [(i * self.intensity) for i in self.color]
+
+    def GetShadowRay(self, point):
+        # Direccion hacia la luz y distancia maxima a la que un objeto la
+        # tapa, o None si la luz no proyecta sombras
+        return None
+
+    def GetShadowRays(self, points):
+        return None
+
+    def GetInfluenceBounds(self):
+        # Caja (minimo, maximo) fuera de la cual la luz no aporta, o None si
+        # ilumina toda la escena
+        return None
+
+    def GetInfluenceMask(self, points):
+        # Por punto, si la luz puede aportar algo ahi
+        return np.ones(len(points), dtype=bool)
     
     def GetSpecularColor(self, intercept, viewPos):
         return [0,0,0]
+
+    def Evaluate(self, intercept, viewPos):
+        # Aporte difuso y especular juntos, con la geometria de la luz
+        # calculada una sola vez
+        return self.GetLightColor(intercept), self.GetSpecularColor(intercept, viewPos)
+
+    # Versiones por lotes: points y normals son arreglos (N,3) de puntos de
+    # impacto y el resultado es un color (N,3) por punto
+
+    def GetLightColors(self, points, normals):
+        return np.tile(np.multiply(self.color, self.intensity), (len(points), 1))
+
+    def GetSpecularColors(self, points, normals, viewPos, spec, ks):
+        return np.zeros((len(points), 3))
+
+    def EvaluateBatch(self, points, normals, viewPos, spec, ks):
+        return self.GetLightColors(points, normals), self.GetSpecularColors(points, normals, viewPos, spec, ks)
     
 class DirectionalLight(Light):
     def __init__(self, color = [1,1,1], intensity = 1.0, direction = [0,-1,0]):
@@ -20,32 +61,63 @@ class DirectionalLight(Light):
         self.direction = direction / np.linalg.norm(direction)
 
     def GetLightColor(self, intercept = None):
-        lightColor =  super().GetLightColor()
-
-        if intercept:
-            dir = [(i * -1) for i in self.direction]
-            surfaceIntensity = np.dot(intercept.normal, dir)
-            # surfaceIntensity *= 1 - intercept.obj.material.ks
-            surfaceIntensity = max(0, min(1, surfaceIntensity))
-            lightColor = [(i * surfaceIntensity) for i in lightColor]
-
-        return lightColor
+        if not intercept:
+            return super().GetLightColor()
+        return self.Evaluate(intercept, None)[0]
     
     def GetSpecularColor(self, intercept, viewPos):
-        specColor = self.color
-        if intercept:
-            dir = [(i * -1) for i in self.direction]
-            reflect = reflectVector(intercept.normal, dir)
+        if not intercept:
+            return self.color
+        return self.Evaluate(intercept, viewPos)[1]
+
+    def Evaluate(self, intercept, viewPos):
+        # Sin viewPos solo se calcula el difuso
+        dir = [(i * -1) for i in self.direction]
+        material = intercept.obj.material
+
+        surfaceIntensity = max(0, min(1, np.dot(intercept.normal, dir)))
+        diffuse = [(i * self.intensity) * surfaceIntensity for i in self.color]
+
+        if viewPos is None:
+            return diffuse, [0, 0, 0]
+
+        reflect = reflectVector(intercept.normal, dir)
+        viewDir = np.subtract(viewPos, intercept.point)
+        viewDir /= np.linalg.norm(viewDir)
+
+        specIntensity = max(0, np.dot(viewDir, reflect)) ** material.spec
+        specIntensity *= material.ks
+        specIntensity *= self.intensity
+        specular = [(i * specIntensity) for i in self.color]
+
+        return diffuse, specular
+
+    def GetShadowRay(self, point):
+        return [-i for i in self.direction], float('inf')
 
-            viewDir = np.subtract(viewPos, intercept.point)
-            viewDir /= np.linalg.norm(viewDir)
+    def GetShadowRays(self, points):
+        return np.broadcast_to(-self.direction, np.shape(points)), np.inf
 
-            specIntensity = max(0, np.dot(viewDir, reflect)) ** intercept.obj.material.spec
-            specIntensity *= intercept.obj.material.ks
-            specIntensity *= self.intensity 
-            specColor = [(i * specIntensity) for i in specColor] 
+    def GetLightColors(self, points, normals):
+        lightColor = super().GetLightColors(points, normals)
 
-        return specColor
+        dir = -self.direction
+        surfaceIntensity = np.clip(normals @ dir, 0, 1)
+
+        return lightColor * surfaceIntensity[:, None]
+
+    def GetSpecularColors(self, points, normals, viewPos, spec, ks):
+        dir = np.broadcast_to(-self.direction, normals.shape)
+        reflect = reflectVectorBatch(normals, dir)
+
+        viewDir = np.subtract(viewPos, points)
+        viewDir /= np.linalg.norm(viewDir, axis=1, keepdims=True)
+
+        specIntensity = np.maximum(0, np.einsum('ij,ij->i', viewDir, reflect)) ** spec
+        specIntensity *= ks
+        specIntensity *= self.intensity
+
+        return np.multiply(self.color, specIntensity[:, None])
     
 class AmbientLight(Light):
     def __init__(self, color = [1,1,1], intensity = 0.1):
@@ -56,35 +128,117 @@ class PointLight(Light):
         super().__init__(color, intensity, 'Point')
         self.position = np.array(position, dtype=float)
         self.lightType = 'Point'
+        self.cutoff = INFLUENCE_CUTOFF
     
+    # Los getters por separado envuelven a Evaluate y EvaluateBatch; como
+    # SpotLight redefine esos dos, sus getters ya incluyen el cono
+
     def GetLightColor(self, intercept=None):
-        lightColor = super().GetLightColor()
-        if intercept is not None:
-            dir_vec = self.position - intercept.point
-            R = np.linalg.norm(dir_vec)
-            if R == 0:
-                return [0,0,0]
-            wi = dir_vec / R
-            surfaceIntensity = max(0.0, np.dot(intercept.normal, wi))
-            surfaceIntensity *= self.intensity / (R*R)
-            lightColor = [c * surfaceIntensity for c in self.color]
-        return lightColor
+        if intercept is None:
+            return super().GetLightColor()
+        return self.Evaluate(intercept, None)[0]
 
     def GetSpecularColor(self, intercept, viewPos):
         if intercept is None:
             return [0,0,0]
+        return self.Evaluate(intercept, viewPos)[1]
+
+    def Evaluate(self, intercept, viewPos):
         dir_vec = self.position - intercept.point
         R = np.linalg.norm(dir_vec)
         if R == 0:
-            return [0,0,0]
-        wi = dir_vec / R
+            return [0,0,0], [0,0,0]
+        return self._shade(intercept, viewPos, dir_vec / R, R)
+
+    def _shade(self, intercept, viewPos, wi, R):
+        # Sin viewPos solo se calcula el difuso
+        material = intercept.obj.material
+        attenuation = self.intensity / (R*R)
+
+        surfaceIntensity = max(0.0, np.dot(intercept.normal, wi))
+        surfaceIntensity *= attenuation
+        diffuse = [c * surfaceIntensity for c in self.color]
+
+        if viewPos is None:
+            return diffuse, [0,0,0]
+
         reflect = reflectVector(intercept.normal, wi)
         viewDir = np.array(viewPos, dtype=float) - intercept.point
         viewDir /= np.linalg.norm(viewDir)
-        specIntensity = max(0.0, np.dot(viewDir, reflect)) ** intercept.obj.material.spec
-        specIntensity *= intercept.obj.material.ks
-        specIntensity *= self.intensity / (R*R)
-        return [c * specIntensity for c in self.color]
+        specIntensity = max(0.0, np.dot(viewDir, reflect)) ** material.spec
+        specIntensity *= material.ks
+        specIntensity *= attenuation
+        specular = [c * specIntensity for c in self.color]
+
+        return diffuse, specular
+
+    def GetShadowRay(self, point):
+        dir_vec = self.position - point
+        R = np.linalg.norm(dir_vec)
+        if R == 0:
+            return None
+        return dir_vec / R, R
+
+    def GetShadowRays(self, points):
+        wi, R, _ = self._incidence(points)
+        return wi, R
+
+    def GetInfluenceRadius(self):
+        # El aporte cae con 1/R^2 (el especular tambien, con ks <= 1), asi
+        # que pasado este radio queda por debajo de cutoff
+        if self.cutoff <= 0:
+            return float('inf')
+        return (self.intensity * max(self.color) / self.cutoff) ** 0.5
+
+    def GetInfluenceBounds(self):
+        radius = self.GetInfluenceRadius()
+        if radius == float('inf'):
+            return None
+        return self.position - radius, self.position + radius
+
+    def GetInfluenceMask(self, points):
+        radius = self.GetInfluenceRadius()
+        dir_vec = self.position - points
+        return np.einsum('ij,ij->i', dir_vec, dir_vec) < radius * radius
+
+    def _incidence(self, points):
+        dir_vec = self.position - points
+        R = np.linalg.norm(dir_vec, axis=1)
+        valid = R > 0
+        wi = dir_vec / np.where(valid, R, 1)[:, None]
+        return wi, R, valid
+
+    def GetLightColors(self, points, normals):
+        return self.EvaluateBatch(points, normals, None, 0, 0)[0]
+
+    def GetSpecularColors(self, points, normals, viewPos, spec, ks):
+        return self.EvaluateBatch(points, normals, viewPos, spec, ks)[1]
+
+    def EvaluateBatch(self, points, normals, viewPos, spec, ks):
+        wi, R, valid = self._incidence(points)
+        return self._shadeBatch(points, normals, viewPos, spec, ks, wi, R, valid)
+
+    def _shadeBatch(self, points, normals, viewPos, spec, ks, wi, R, valid):
+        attenuation = self.intensity / np.where(valid, R*R, 1)
+
+        surfaceIntensity = np.maximum(0.0, np.einsum('ij,ij->i', normals, wi))
+        surfaceIntensity *= attenuation
+        surfaceIntensity[~valid] = 0
+        diffuse = np.multiply(self.color, surfaceIntensity[:, None])
+
+        if viewPos is None:
+            return diffuse, np.zeros((len(points), 3))
+
+        reflect = reflectVectorBatch(normals, wi)
+        viewDir = np.subtract(np.asarray(viewPos, dtype=float), points)
+        viewDir /= np.linalg.norm(viewDir, axis=1, keepdims=True)
+
+        specIntensity = np.maximum(0.0, np.einsum('ij,ij->i', viewDir, reflect)) ** spec
+        specIntensity *= ks
+        specIntensity *= attenuation
+        specIntensity[~valid] = 0
+
+        return diffuse, np.multiply(self.color, specIntensity[:, None])
 
 
 class SpotLight(PointLight):
@@ -97,26 +251,128 @@ class SpotLight(PointLight):
         self.outerAngle = float(outerAngle)
         self.lightType = 'Spot'
 
-    def _edge_attenuation(self, intercept):
-        if intercept is None:
-            return 0.0
-        wi = self.position - intercept.point
-        wi /= np.linalg.norm(wi)
+    def _cone_attenuations(self, wi):
+        # Atenuacion del borde del cono para direcciones wi (N,3) hacia la luz
         innerRad = self.innerAngle * pi / 180.0
         outerRad = self.outerAngle * pi / 180.0
-        cosTheta = np.dot(self.direction, -wi)
+        cosTheta = -(wi @ self.direction)
         denom = (cos(innerRad) - cos(outerRad))
         if abs(denom) < 1e-8:
-            return 0.0
+            return np.zeros(len(wi))
         att = (cosTheta - cos(outerRad)) / denom
-        return max(0.0, min(1.0, att))
+        return np.clip(att, 0.0, 1.0)
+
+    def _cone_attenuation(self, wi):
+        return float(self._cone_attenuations(np.asarray(wi, dtype=float)[None])[0])
 
     def GetLightColor(self, intercept=None):
-        base = super().GetLightColor(intercept)
-        edge = self._edge_attenuation(intercept)
-        return [c * edge for c in base]
+        # Sin punto no hay direccion para saber si cae dentro del cono
+        if intercept is None:
+            return [0,0,0]
+        return super().GetLightColor(intercept)
 
-    def GetSpecularColor(self, intercept, viewPos):
-        base = super().GetSpecularColor(intercept, viewPos)
-        edge = self._edge_attenuation(intercept)
-        return [c * edge for c in base]
\ No newline at end of file
+    def Evaluate(self, intercept, viewPos):
+        dir_vec = self.position - intercept.point
+        R = np.linalg.norm(dir_vec)
+        if R == 0:
+            return [0,0,0], [0,0,0]
+        wi = dir_vec / R
+
+        edge = self._cone_attenuation(wi)
+        if edge == 0:
+            return [0,0,0], [0,0,0]
+
+        diffuse, specular = self._shade(intercept, viewPos, wi, R)
+        return [c * edge for c in diffuse], [c * edge for c in specular]
+
+    def _edge_attenuations(self, points, wi = None):
+        if wi is None:
+            wi, _, _ = self._incidence(points)
+        return self._cone_attenuations(wi)
+
+    def GetInfluenceMask(self, points):
+        # Ademas del radio, fuera del cono exterior el aporte es cero
+        mask = super().GetInfluenceMask(points)
+        mask[mask] = self._edge_attenuations(points[mask]) > 0
+        return mask
+
+    def EvaluateBatch(self, points, normals, viewPos, spec, ks):
+        wi, R, valid = self._incidence(points)
+        edge = self._edge_attenuations(points, wi)[:, None]
+        diffuse, specular = self._shadeBatch(points, normals, viewPos, spec, ks, wi, R, valid)
+        return diffuse * edge, specular * edge
+
+
+class LightGrid(object):
+    # Rejilla uniforme sobre las cajas de influencia de las luces. Cada celda
+    # sabe que luces la tocan, asi que un punto solo evalua esas y las que
+    # iluminan toda la escena.
+
+    def __init__(self, lights, resolution = None):
+        self.lights = list(lights)
+
+        bounds = [light.GetInfluenceBounds() for light in self.lights]
+        self.unbounded = np.array([box is None for box in bounds], dtype=bool)
+        boxes = np.array([box for box in bounds if box is not None], dtype=float).reshape(-1, 2, 3)
+        bounded = np.nonzero(~self.unbounded)[0]
+
+        if resolution is None:
+            resolution = int(min(16, max(1, round(2 * len(bounded) ** (1 / 3)))))
+        self.resolution = resolution
+
+        if len(bounded) == 0:
+            self.origin = np.zeros(3)
+            self.cellSize = np.ones(3)
+            self.cells = np.zeros((1, len(self.lights)), dtype=bool)
+            return
+
+        self.origin = boxes[:, 0].min(axis=0)
+        self.cellSize = np.maximum((boxes[:, 1].max(axis=0) - self.origin) / resolution, 1e-9)
+
+        # cells[c, l]: la luz l toca la celda c
+        self.cells = np.zeros((resolution ** 3, len(self.lights)), dtype=bool)
+        lo = self._Cell(boxes[:, 0])
+        hi = self._Cell(boxes[:, 1])
+
+        for l, a, b in zip(bounded, lo, hi):
+            x, y, z = np.meshgrid(np.arange(a[0], b[0] + 1), np.arange(a[1], b[1] + 1),
+                                  np.arange(a[2], b[2] + 1), indexing='ij')
+            self.cells[((x * resolution + y) * resolution + z).ravel(), l] = True
+
+    def _Cell(self, points):
+        cell = np.floor((points - self.origin) / self.cellSize).astype(int)
+        return np.clip(cell, 0, self.resolution - 1)
+
+    def GetCandidates(self, points):
+        # (N, luces): que luces pueden aportar en cada punto segun su celda
+        points = np.atleast_2d(points)
+        candidates = np.tile(self.unbounded, (len(points), 1))
+
+        # Fuera de la rejilla solo aportan las luces sin limite
+        cell = self._Cell(points)
+        inside = ((points >= self.origin) & (points <= self.origin + self.cellSize * self.resolution)).all(axis=1)
+        index = (cell[:, 0] * self.resolution + cell[:, 1]) * self.resolution + cell[:, 2]
+        candidates[inside] |= self.cells[index[inside]]
+
+        return candidates
+
+    def GetLights(self, point):
+        # Luces que pueden aportar en un solo punto
+        point = np.asarray(point, dtype=float).reshape(1, 3)
+        candidates = self.GetCandidates(point)[0]
+        return [light for light, c in zip(self.lights, candidates)
+                if c and light.GetInfluenceMask(point)[0]]
+
+    def GetLightsForPoints(self, points):
+        # Por cada luz que aporta en algun punto: (luz, indices de esos puntos)
+        candidates = self.GetCandidates(points)
+        result = []
+
+        for l, light in enumerate(self.lights):
+            index = np.nonzero(candidates[:, l])[0]
+            if len(index):
+                index = index[light.GetInfluenceMask(points[index])]
+                if len(index):
+                    result.append((light, index))
+
+        return result
@@ -15,7 +15,9 @@ class Material(object):
         self.matType = matType
         self.texture = texture
 
-    def GetSurfaceColor(self, intercept, renderer, recursion = 0):
+    def GetSurfaceColor(self, intercept, renderer, recursion = 0, throughput = (1, 1, 1)):
+        # throughput es cuanto aporta este punto al pixel; con el se decide
+        # si vale la pena seguir los rayos de reflexion y refraccion
 
         lightColor = [0,0,0]
         specColor = [0,0,0]
@@ -30,29 +32,31 @@ class Material(object):
             finalColor = [finalColor[i] * textureColor[i] for i in range(3)]
 
 
-        for light in renderer.lights:
-            shadowIntercept = None
-
-            if light.lightType == 'Directional':
-                lightDir = [-i for i in light.direction]
-                shadowIntercept = renderer.glCastRay(intercept.point, lightDir, intercept.obj)
-
-            if shadowIntercept == None:
-                specColor = [(specColor[i] + light.GetSpecularColor(intercept, renderer.camera.translation)[i]) for i in range(3)]
+        for light in renderer.glLightsAt(intercept.point):
+            if not renderer.glShadowed(light, intercept.point, intercept.obj):
+                diffuse, specular = light.Evaluate(intercept, renderer.camera.translation)
+                specColor = [(specColor[i] + specular[i]) for i in range(3)]
 
                 if self.matType == OPAQUE:
-                    lightColor = [(lightColor[i] + light.GetLightColor(intercept)[i]) for i in range(3)]
+                    lightColor = [(lightColor[i] + diffuse[i]) for i in range(3)]
 
         if self.matType == REFLECTIVE:
             rayDir = [-i for i in intercept.rayDirection]
             reflect = reflectVector(intercept.normal, rayDir)
 
-            reflectIntercept = renderer.glCastRay(intercept.point, reflect, intercept.obj, recursion + 1)
+            reflectThroughput = [throughput[i] * finalColor[i] for i in range(3)]
+            weight = renderer.glPathWeight(reflectThroughput, recursion + 1)
+
+            if weight > 0:
+                reflectThroughput = [i * weight for i in reflectThroughput]
+                reflectIntercept = renderer.glCastRay(intercept.point, reflect, intercept.obj, recursion + 1)
+
+                if reflectIntercept != None:
+                    reflectColor = reflectIntercept.obj.material.GetSurfaceColor(reflectIntercept, renderer, recursion + 1, reflectThroughput)
+                else:
+                    reflectColor = renderer.glEnvMapColor(intercept.point, reflect)
 
-            if reflectIntercept != None:
-                reflectColor = reflectIntercept.obj.material.GetSurfaceColor(reflectIntercept, renderer, recursion + 1)
-            else:
-                reflectColor = renderer.glEnvMapColor(intercept.point, reflect)
+                reflectColor = [i * weight for i in reflectColor]
 
         if self.matType == TRANSPARENT:
             outside = np.dot(intercept.normal, intercept.rayDirection) < 0
@@ -64,27 +68,40 @@ class Material(object):
 
             reflectOrig = np.add(intercept.point, bias) if outside else np.subtract(intercept.point, bias)
 
-            reflectIntercept = renderer.glCastRay(reflectOrig, reflect, None, recursion + 1)
+            # Con reflexion interna total no hay refraccion y la reflexion no se pondera
+            tir = totalInternalReflection(intercept.normal, intercept.rayDirection, 1.0, self.ior)
+            Kr, Kt = (1, 0) if tir else fresnel(intercept.normal, intercept.rayDirection, 1.0, self.ior)
 
-            if reflectIntercept != None:
-                reflectColor = reflectIntercept.obj.material.GetSurfaceColor(reflectIntercept, renderer, recursion + 1)
-            else:
-                reflectColor = renderer.glEnvMapColor(intercept.point, reflect) 
+            reflectThroughput = [throughput[i] * finalColor[i] * Kr for i in range(3)]
+            weight = renderer.glPathWeight(reflectThroughput, recursion + 1)
+
+            if weight > 0:
+                reflectThroughput = [i * weight for i in reflectThroughput]
+                reflectIntercept = renderer.glCastRay(reflectOrig, reflect, None, recursion + 1)
+
+                if reflectIntercept != None:
+                    reflectColor = reflectIntercept.obj.material.GetSurfaceColor(reflectIntercept, renderer, recursion + 1, reflectThroughput)
+                else:
+                    reflectColor = renderer.glEnvMapColor(intercept.point, reflect) 
+
+                reflectColor = [i * Kr * weight for i in reflectColor]
 
             #refraction
-            if not totalInternalReflection(intercept.normal, intercept.rayDirection, 1.0, self.ior):
+            refractThroughput = [throughput[i] * finalColor[i] * Kt for i in range(3)]
+            weight = renderer.glPathWeight(refractThroughput, recursion + 1) if not tir else 0
+
+            if weight > 0:
+                refractThroughput = [i * weight for i in refractThroughput]
                 refract = refractVector(intercept.normal, intercept.rayDirection, 1.0, self.ior)
                 refractOrig = np.subtract(intercept.point, bias) if outside else np.add(intercept.point, bias)
                 refractIntercept = renderer.glCastRay(refractOrig, refract, None, recursion + 1)
 
                 if refractIntercept != None:
-                    refractColor = refractIntercept.obj.material.GetSurfaceColor(refractIntercept, renderer, recursion + 1)
+                    refractColor = refractIntercept.obj.material.GetSurfaceColor(refractIntercept, renderer, recursion + 1, refractThroughput)
                 else:
                     refractColor = renderer.glEnvMapColor(intercept.point, refract) 
 
-                Kr, Kt = fresnel(intercept.normal, intercept.rayDirection, 1.0, self.ior)
-                reflectColor = [i * Kr for i in reflectColor]
-                refractColor = [i * Kt for i in refractColor]
+                refractColor = [i * Kt * weight for i in refractColor]
 
         surfaceColor = [finalColor[i] * (lightColor[i] + reflectColor[i] + refractColor[i]) for i in range(3)]
         finalColor = [surfaceColor[i] + specColor[i] for i in range(3)]
@@ -0,0 +1,185 @@
+import numpy as np
+from figures import Shape, rays_as_arrays, batch_result
+from intercept import Intercept
+from bvh import BVH
+
+# Malla de triangulos guardada en arreglos: una sola figura de la escena con
+# su propio BVH sobre los triangulos, en lugar de un objeto Triangle por cara.
+
+def IntersectTriangles(orig, dir, v0, e1, e2):
+    # Moller-Trumbore con broadcasting: orig y dir contra los triangulos
+    # (v0, e1 = v1 - v0, e2 = v2 - v0). Devuelve distancia (inf si no hay
+    # impacto) y las coordenadas baricentricas u, v.
+
+    EPSILON = 1e-6
+    h = np.cross(dir, e2)
+    a = np.einsum('...k,...k->...', h, e1)
+
+    hit = np.abs(a) >= EPSILON
+    f = 1.0 / np.where(hit, a, 1.0)
+
+    s = orig - v0
+    u = f * np.einsum('...k,...k->...', s, h)
+    hit &= (u >= 0.0) & (u <= 1.0)
+
+    q = np.cross(s, e1)
+    v = f * np.einsum('...k,...k->...', dir, q)
+    hit &= (v >= 0.0) & ((u + v) <= 1.0)
+
+    t = f * np.einsum('...k,...k->...', q, e2)
+    hit &= t > EPSILON
+
+    return np.where(hit, t, np.inf), u, v
+
+
+class Mesh(Shape):
+    # vertices (V,3) e indices (F,3) de los triangulos. normals (N,3) con
+    # normalIndices (F,3) y texCoords (T,2) con texIndices (F,3) son
+    # opcionales; un indice -1 indica que esa esquina no tiene dato y el
+    # triangulo usa su normal plana o no tiene coordenadas de textura.
+    # model es un Model cuya matriz se aplica a vertices y normales.
+
+    # Arreglos que se pueden pasar a memoria compartida al renderizar en paralelo
+    sharedArrays = ('v0', 'e1', 'e2', 'faceNormals', 'vertexNormals', 'normalIndices', 'uvs', 'texIndices')
+
+    def __init__(self, vertices, indices, material, normals = None, normalIndices = None,
+                 texCoords = None, texIndices = None, model = None, smooth = False, tree = None):
+
+        vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+        indices = np.asarray(indices, dtype=int).reshape(-1, 3)
+
+        if model:
+            transform = model.GetTransform()
+            vertices = transform.TransformPoints(vertices)
+
+            # Las normales se transforman con la inversa transpuesta
+            if normals is not None:
+                normals = transform.TransformNormals(np.asarray(normals, dtype=float).reshape(-1, 3))
+
+        super().__init__(vertices.mean(axis=0) if len(vertices) else np.zeros(3), material)
+        self.type = 'Mesh'
+
+        self.minBound = vertices.min(axis=0) if len(vertices) else np.zeros(3)
+        self.maxBound = vertices.max(axis=0) if len(vertices) else np.zeros(3)
+
+        self.v0 = vertices[indices[:, 0]]
+        self.e1 = vertices[indices[:, 1]] - self.v0
+        self.e2 = vertices[indices[:, 2]] - self.v0
+
+        faceNormals = np.cross(self.e1, self.e2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.faceNormals = np.nan_to_num(faceNormals / np.linalg.norm(faceNormals, axis=1, keepdims=True))
+
+        # Sin normales en el archivo, smooth promedia las de las caras vecinas
+        if normals is None and smooth:
+            normals = np.zeros(vertices.shape)
+            for k in range(3):
+                np.add.at(normals, indices[:, k], faceNormals)
+            normalIndices = indices
+
+        if normals is not None:
+            normals = np.asarray(normals, dtype=float).reshape(-1, 3)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.vertexNormals = np.nan_to_num(normals / np.linalg.norm(normals, axis=1, keepdims=True))
+            self.normalIndices = np.asarray(normalIndices, dtype=int).reshape(-1, 3)
+        else:
+            self.vertexNormals = None
+            self.normalIndices = None
+
+        if texCoords is not None:
+            self.uvs = np.asarray(texCoords, dtype=float).reshape(-1, 2)
+            self.texIndices = np.asarray(texIndices, dtype=int).reshape(-1, 3)
+        else:
+            self.uvs = None
+            self.texIndices = None
+
+        if tree is None:
+            bounds = np.stack((np.minimum(np.minimum(self.v0, self.v0 + self.e1), self.v0 + self.e2),
+                               np.maximum(np.maximum(self.v0, self.v0 + self.e1), self.v0 + self.e2)), axis=1)
+            tree = BVH(bounds, leafSize = 8)
+        self.tree = tree
+
+    def GetBounds(self):
+        return self.minBound, self.maxBound
+
+    def Interpolate(self, face, u, v):
+        # Normal y coordenadas de textura en los puntos (u, v) de las caras face
+        normal = self.faceNormals[face]
+        w = np.stack((1 - u - v, u, v), axis=1)[:, :, None]
+
+        if self.vertexNormals is not None:
+            corners = self.normalIndices[face]
+            smooth = (corners >= 0).all(axis=1)
+            interpolated = (self.vertexNormals[corners] * w).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                interpolated /= np.linalg.norm(interpolated, axis=1, keepdims=True)
+            normal = np.where((smooth & np.isfinite(interpolated).all(axis=1))[:, None], interpolated, normal)
+
+        texCoord = np.full((len(face), 2), np.nan)
+        if self.uvs is not None:
+            corners = self.texIndices[face]
+            hasUV = (corners >= 0).all(axis=1)
+            texCoord[hasUV] = (self.uvs[corners[hasUV]] * w[hasUV]).sum(axis=1)
+
+        return normal, texCoord
+
+    def ray_intersect(self, orig, dir):
+        orig = np.array(orig, dtype=float)
+        dir = np.array(dir, dtype=float)
+
+        # Triangulo mas cercano: cara, distancia y coordenadas baricentricas
+        best = [-1, float('inf'), 0.0, 0.0]
+
+        def testLeaf(items, maxDistance):
+            t, u, v = IntersectTriangles(orig, dir, self.v0[items], self.e1[items], self.e2[items])
+            k = np.argmin(t)
+            if t[k] < maxDistance:
+                best[:] = items[k], t[k], u[k], v[k]
+                maxDistance = t[k]
+            return maxDistance
+
+        self.tree.Traverse(orig, dir, testLeaf)
+
+        face, distance, u, v = best
+        if face < 0:
+            return None
+
+        normal, texCoord = self.Interpolate(np.array([face]), np.array([u]), np.array([v]))
+
+        return Intercept(
+            point=orig + dir * distance,
+            normal=normal[0],
+            distance=distance,
+            obj=self,
+            rayDirection=dir,
+            texCoord=None if np.isnan(texCoord[0, 0]) else list(texCoord[0])
+        )
+
+    def ray_intersect_batch(self, orig, dir):
+        orig, dir = rays_as_arrays(orig, dir)
+
+        depth = np.full(len(dir), np.inf)
+        face = np.full(len(dir), -1)
+        bu = np.zeros(len(dir))
+        bv = np.zeros(len(dir))
+
+        def testLeaf(items, rays):
+            t, u, v = IntersectTriangles(orig[rays, None], dir[rays, None],
+                                         self.v0[items], self.e1[items], self.e2[items])
+            k = np.argmin(t, axis=1)
+            r = np.arange(len(rays))
+            closer = t[r, k] < depth[rays]
+            rays, k, r = rays[closer], k[closer], r[closer]
+            depth[rays] = t[r, k]
+            face[rays] = items[k]
+            bu[rays] = u[r, k]
+            bv[rays] = v[r, k]
+
+        self.tree.TraverseBatch(orig, dir, depth, testLeaf)
+
+        hit = face >= 0
+        normal = np.zeros(dir.shape)
+        texCoord = np.full((len(dir), 2), np.nan)
+        normal[hit], texCoord[hit] = self.Interpolate(face[hit], bu[hit], bv[hit])
+
+        return batch_result(depth, normal, texCoord, hit)
@@ -1,4 +1,5 @@
 from Mathlib import *
+from transform import ModelTransform
 
 class Model(object):
     def __init__(self):
@@ -12,18 +13,12 @@ class Model(object):
         self.vertexShader = None
 
 
-    def GetModelMatrix(self):
+    def GetTransform(self):
 
-        translateMat = TranslationMatrix(self.translation[0],
-                                         self.translation[1],
-                                         self.translation[2])
+        # Guardada por pose: si no cambio, se reutiliza con su inversa
+        return ModelTransform(self.translation, self.rotation, self.scale)
 
-        rotateMat = RotationMatrix(self.rotation[0],
-                                   self.rotation[1],
-                                   self.rotation[2])
 
-        scaleMat = ScaleMatrix(self.scale[0],
-                               self.scale[1],
-                               self.scale[2])
+    def GetModelMatrix(self):
 
-        return translateMat * rotateMat * scaleMat
\ No newline at end of file
+        return self.GetTransform().matrix
\ No newline at end of file
@@ -0,0 +1,175 @@
+import numpy as np
+import hashlib
+import os
+import zipfile
+from figures import Shape
+from mesh import Mesh
+from bvh import BVH
+
+# Lector de archivos OBJ. Guarda vertices (v), coordenadas de textura (vt) y
+# normales (vn) en arreglos y las caras (f) como indices base 0 por esquina;
+# los poligonos de mas de tres lados se dividen en abanico.
+
+class Obj(object):
+    def __init__(self, filename):
+        vertices = []
+        texCoords = []
+        normals = []
+        faces = []
+
+        with open(filename, 'r') as file:
+            for line in file:
+                parts = line.split()
+                if not parts:
+                    continue
+
+                prefix = parts[0]
+
+                if prefix == 'v':
+                    vertices.append([float(i) for i in parts[1:4]])
+                elif prefix == 'vt':
+                    texCoords.append([float(i) for i in parts[1:3]])
+                elif prefix == 'vn':
+                    normals.append([float(i) for i in parts[1:4]])
+                elif prefix == 'f':
+                    corners = [self._ParseCorner(i, len(vertices), len(texCoords), len(normals)) for i in parts[1:]]
+                    for k in range(1, len(corners) - 1):
+                        faces.append((corners[0], corners[k], corners[k + 1]))
+
+        self.vertices = np.array(vertices, dtype=float).reshape(-1, 3)
+        self.texCoords = np.array(texCoords, dtype=float).reshape(-1, 2)
+        self.normals = np.array(normals, dtype=float).reshape(-1, 3)
+
+        # (F, 3, 3): por cara y esquina, los indices de vertice, textura y normal
+        faces = np.array(faces, dtype=int).reshape(-1, 3, 3)
+        self.indices = faces[:, :, 0]
+        self.texIndices = faces[:, :, 1]
+        self.normalIndices = faces[:, :, 2]
+
+    def _ParseCorner(self, corner, vertexCount, texCount, normalCount):
+        # 'v', 'v/vt', 'v//vn' o 'v/vt/vn'; los indices negativos cuentan
+        # desde el final. Un dato que falta queda como -1.
+        indices = []
+        values = corner.split('/')
+        counts = (vertexCount, texCount, normalCount)
+
+        for k in range(3):
+            if k < len(values) and values[k]:
+                i = int(values[k])
+                indices.append(i - 1 if i > 0 else counts[k] + i)
+            else:
+                indices.append(-1)
+
+        return indices
+
+    def GetMesh(self, material, model = None, smooth = False):
+        return Mesh(self.vertices, self.indices, material,
+                    normals = self.normals if len(self.normals) else None,
+                    normalIndices = self.normalIndices,
+                    texCoords = self.texCoords if len(self.texCoords) else None,
+                    texIndices = self.texIndices,
+                    model = model,
+                    smooth = smooth)
+
+
+# Cache en disco de las mallas ya transformadas y de su BVH. La llave es un
+# hash del contenido del OBJ, la matriz del modelo y las opciones, asi que
+# cambiar cualquiera de ellos genera otra entrada. Subir CACHE_VERSION
+# invalida todo si cambia el formato de Mesh o BVH.
+
+CACHE_VERSION = 1
+
+def MeshCacheKey(filename, model = None, smooth = False):
+    key = hashlib.sha1()
+    key.update(b'mesh %d %d' % (CACHE_VERSION, bool(smooth)))
+
+    if model:
+        key.update(np.ascontiguousarray(model.GetModelMatrix(), dtype=float).tobytes())
+
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            key.update(chunk)
+
+    return key.hexdigest()
+
+
+def SaveMesh(path, mesh):
+    # Guarda los arreglos de la malla y los de su BVH (prefijo tree_) en un
+    # .npz sin comprimir. Se escribe a un temporal para no dejar un archivo
+    # a medias si el proceso se interrumpe.
+    arrays = {}
+
+    for name, value in mesh.__dict__.items():
+        if name not in ('material', 'tree') and value is not None:
+            arrays[name] = value
+    for name, value in mesh.tree.__getstate__().items():
+        arrays['tree_' + name] = value
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temp, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temp, path)
+    finally:
+        # Si algo fallo el temporal sigue ahi y no sirve para nada
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def LoadCachedMesh(path, material):
+    mesh = Mesh.__new__(Mesh)
+    Shape.__init__(mesh, None, material)
+    tree = {}
+
+    with np.load(path) as arrays:
+        for name in arrays.files:
+            value = arrays[name]
+            value = value.item() if value.ndim == 0 else value
+
+            if name.startswith('tree_'):
+                tree[name[len('tree_'):]] = value
+            else:
+                setattr(mesh, name, value)
+
+    # Una entrada incompleta se trata como ilegible y se reconstruye
+    for name in ('v0', 'e1', 'e2', 'faceNormals'):
+        if not hasattr(mesh, name):
+            raise KeyError(name)
+    for name in ('nodeMin', 'nodeMax', 'left', 'right', 'first', 'count', 'items'):
+        if name not in tree:
+            raise KeyError('tree_' + name)
+
+    for name in Mesh.sharedArrays:
+        if not hasattr(mesh, name):
+            setattr(mesh, name, None)
+
+    mesh.tree = BVH.__new__(BVH)
+    mesh.tree.__setstate__(tree)
+    return mesh
+
+
+def LoadMesh(filename, material, model = None, smooth = False, cacheDir = None, useCache = True):
+    # Sin cacheDir el cache queda en .meshcache junto al archivo OBJ
+    if not useCache:
+        return Obj(filename).GetMesh(material, model, smooth)
+
+    if cacheDir is None:
+        cacheDir = os.path.join(os.path.dirname(os.path.abspath(filename)), '.meshcache')
+
+    path = os.path.join(cacheDir, MeshCacheKey(filename, model, smooth) + '.npz')
+
+    if os.path.exists(path):
+        try:
+            return LoadCachedMesh(path, material)
+        except (OSError, EOFError, ValueError, KeyError, AttributeError, zipfile.BadZipFile):
+            pass
+
+    mesh = Obj(filename).GetMesh(material, model, smooth)
+
+    try:
+        SaveMesh(path, mesh)
+    except OSError:
+        pass
+
+    return mesh
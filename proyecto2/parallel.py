@@ -0,0 +1,117 @@
+import multiprocessing
+import signal
+from sharedmem import ToShared
+
+# Render por tiles en varios procesos. La escena viaja una sola vez a cada
+# proceso (en el initializer del Pool) y cada tarea es solo un tile. Los
+# arreglos grandes (texturas, BVH, tablas de la escena compilada y
+# frameBuffer) se pasan a memoria compartida antes de crear el Pool, asi
+# que cada proceso se adjunta a ellos sin copiarlos y escribe sus tiles
+# directo en el frameBuffer.
+
+_renderer = None
+
+def _InitWorker(renderer):
+    global _renderer
+
+    # Al hacer fork despues de abrir la ventana, el proceso hereda el manejador
+    # de SIGTERM de SDL y Pool.terminate() nunca lograria detenerlo
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    _renderer = renderer
+
+def _ShadeTile(tile):
+    # Los rayos del tile se generan aqui; no hay una copia de todos los
+    # rayos primarios en cada proceso
+    result = _renderer.glShadeTile(tile)
+
+    if result:
+        (x0, y0, x1, y1), colors = result
+        _renderer.frameBuffer[y0:y1, x0:x1] = colors
+        return (x0, y0, x1, y1)
+
+    return None
+
+
+class SharedScene(object):
+    # Mientras esta activo, los arreglos grandes del renderer viven en
+    # memoria compartida; al salir se restauran los originales.
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.swapped = []
+
+    def __enter__(self):
+        renderer = self.renderer
+
+        self._Share(renderer, 'frameBuffer')
+
+        if renderer.bvh:
+            for attr in ('nodeMin', 'nodeMax', 'left', 'right', 'first', 'count', 'items'):
+                self._Share(renderer.bvh.tree, attr)
+
+        # Sin BVH, las tablas empacadas de la escena compilada
+        if renderer.compiledScene:
+            for group in renderer.compiledScene.groups.values():
+                for attr in group.sharedArrays:
+                    self._Share(group, attr)
+
+        # Mallas: sus triangulos y su BVH interno. Las que usan las
+        # instancias como prototipo se comparten una sola vez.
+        shapes = {}
+        for obj in renderer.scene:
+            while obj is not None and id(obj) not in shapes:
+                shapes[id(obj)] = obj
+                obj = getattr(obj, 'prototype', None)
+
+        for obj in shapes.values():
+            for attr in getattr(obj, 'sharedArrays', ()):
+                self._Share(obj, attr)
+            if hasattr(obj, 'tree'):
+                for attr in ('nodeMin', 'nodeMax', 'left', 'right', 'first', 'count', 'items'):
+                    self._Share(obj.tree, attr)
+
+        textures = [renderer.envMap] + [obj.material.texture for obj in renderer.scene if obj.material]
+        shared = set()
+        for texture in textures:
+            if texture and id(texture) not in shared:
+                shared.add(id(texture))
+                self._Share(texture, 'pixels')
+
+        return self
+
+    def __exit__(self, *args):
+        for obj, attr, original, shared in reversed(self.swapped):
+            if attr == 'frameBuffer':
+                original[...] = shared
+            setattr(obj, attr, original)
+            shared.shm.unlink()
+
+        self.swapped = []
+
+    def _Share(self, obj, attr):
+        original = getattr(obj, attr)
+        if original is None:
+            return
+
+        shared = ToShared(original)
+        setattr(obj, attr, shared)
+        self.swapped.append((obj, attr, original, shared))
+
+
+def RenderTilesParallel(renderer, tiles, processes = None):
+    # Con una pantalla los tiles se muestran en el orden en que se pidieron;
+    # en modo headless se escriben en cuanto termina cualquiera
+
+    with SharedScene(renderer):
+        with multiprocessing.Pool(processes, initializer = _InitWorker, initargs = (renderer,)) as pool:
+
+            if renderer.screen:
+                results = pool.imap(_ShadeTile, tiles)
+            else:
+                results = pool.imap_unordered(_ShadeTile, tiles)
+
+            for region in results:
+                if region:
+                    renderer.glWriteTile(region)
+                renderer.glPresentUpdate(0, tileDone = True)
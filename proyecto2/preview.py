@@ -0,0 +1,141 @@
+import time
+import numpy as np
+
+# Vista previa interactiva. Primero se traza un pixel por cada bloque de
+# startBlock x startBlock (1/16 de la resolucion en cada eje) y su color
+# llena el bloque entero; cada nivel siguiente divide el bloque a la mitad
+# y solo traza los pixeles que el anterior no tenia, hasta llegar a un rayo
+# por pixel. Update() se llama una vez por cuadro desde el ciclo de eventos
+# y traza solo lo que cabe en frameBudget segundos. Si la camara, la escena
+# o las luces cambian, se vuelve a empezar desde el nivel mas grueso.
+
+# Limites del lote de rayos que se traza entre revisiones del reloj
+MIN_CHUNK = 16
+MAX_CHUNK = 16384
+
+class PreviewRenderer(object):
+    def __init__(self, renderer, startBlock = 16, frameBudget = 1 / 30):
+        self.renderer = renderer
+        self.startBlock = startBlock
+        self.frameBudget = frameBudget
+
+        # Rayos por segundo medidos, para ajustar el lote al tiempo restante
+        self.raysPerSecond = None
+
+        self.Restart()
+
+    def Signature(self):
+        # Todo lo que cambia la imagen y se puede revisar barato en cada cuadro
+        renderer = self.renderer
+        camera = renderer.camera
+
+        objects = tuple((id(obj), tuple(np.ravel(getattr(obj, 'position', ()))))
+                        for obj in renderer.scene)
+
+        lights = tuple((id(light), light.intensity, tuple(light.color),
+                        tuple(np.ravel(getattr(light, 'position', ()))),
+                        tuple(np.ravel(getattr(light, 'direction', ()))))
+                       for light in renderer.lights)
+
+        view = (renderer.vpX, renderer.vpY, renderer.vpWidth, renderer.vpHeight,
+                renderer.rightEdge, renderer.topEdge, renderer.nearPlane)
+
+        return (tuple(camera.translation), tuple(camera.rotation), view, objects, lights)
+
+    def Restart(self):
+        renderer = self.renderer
+        renderer.glPrepareScene()
+
+        self.signature = self.Signature()
+        self.block = self.startBlock
+        self.previousBlock = None
+
+        self.x0, self.y0, self.x1, self.y1 = renderer.glVisibleViewport()
+
+        self.pixels = self.LevelPixels(self.block)
+        self.next = 0
+
+    def Invalidate(self):
+        # Para cambios que Signature no ve (materiales, texturas, radios...)
+        self.signature = None
+
+    def LevelPixels(self, block):
+        # Esquinas de los bloques de este nivel que el nivel anterior no trazo.
+        # Se compara con el bloque anterior y no con 2 * block porque con un
+        # startBlock que no es potencia de dos los niveles no son la mitad
+        # exacta (12, 6, 3, 1).
+        if self.x0 >= self.x1 or self.y0 >= self.y1:
+            return np.zeros((0, 2), dtype = int)
+
+        ys, xs = np.mgrid[self.y0:self.y1:block, self.x0:self.x1:block]
+        ys, xs = ys.ravel(), xs.ravel()
+
+        if self.previousBlock:
+            previous = self.previousBlock
+            coarse = ((xs - self.x0) % previous == 0) & ((ys - self.y0) % previous == 0)
+            ys, xs = ys[~coarse], xs[~coarse]
+
+        return np.stack((ys, xs), axis = 1)
+
+    def Done(self):
+        return self.block == 1 and self.next >= len(self.pixels)
+
+    def Update(self):
+        # Avanza la vista previa durante un cuadro. Devuelve True cuando la
+        # imagen ya tiene un rayo por pixel.
+        start = time.perf_counter()
+
+        if self.Signature() != self.signature:
+            self.Restart()
+
+        renderer = self.renderer
+        orig = np.asarray(renderer.camera.translation, dtype = float)
+        traced = 0
+
+        while not self.Done():
+            if self.next >= len(self.pixels):
+                self.previousBlock = self.block
+                self.block = max(1, self.block // 2)
+                self.pixels = self.LevelPixels(self.block)
+                self.next = 0
+                continue
+
+            remaining = self.frameBudget - (time.perf_counter() - start)
+            if remaining <= 0:
+                break
+
+            chunk = MIN_CHUNK
+            if self.raysPerSecond:
+                chunk = int(np.clip(self.raysPerSecond * remaining, MIN_CHUNK, MAX_CHUNK))
+
+            ys, xs = self.pixels[self.next:self.next + chunk].T
+            self.next += len(ys)
+
+            renderer.glBeginBatch(self.block, self.next)
+
+            chunkStart = time.perf_counter()
+            colors = renderer.glTraceRays(orig, renderer.glPixelRays(xs + 0.5, ys + 0.5))
+            elapsed = time.perf_counter() - chunkStart
+            if elapsed > 0:
+                self.raysPerSecond = len(ys) / elapsed
+
+            self.FillBlocks(ys, xs, colors)
+            traced += len(ys)
+
+        if traced:
+            x0, y0 = self.x0 + renderer.vpX, self.y0 + renderer.vpY
+            renderer.glBlit(x0, y0, self.x1 + renderer.vpX, self.y1 + renderer.vpY)
+            if renderer.screen:
+                renderer.glPresent()
+
+        return self.Done()
+
+    def FillBlocks(self, ys, xs, colors):
+        # Cada pixel trazado pinta su bloque; los niveles finos lo sobrescriben
+        renderer = self.renderer
+        frameBuffer = renderer.frameBuffer
+
+        for dy in range(self.block):
+            for dx in range(self.block):
+                inside = (ys + dy < self.y1) & (xs + dx < self.x1)
+                frameBuffer[ys[inside] + dy + renderer.vpY, xs[inside] + dx + renderer.vpX] = colors[inside]
@@ -0,0 +1,106 @@
+import time
+import numpy as np
+from math import ceil
+
+# Render progresivo con varias muestras por pixel. En cada pasada cada pixel
+# activo recibe una muestra mas en un punto estratificado y con jitter dentro
+# del pixel; el promedio se va mostrando en el frameBuffer. Un pixel deja de
+# recibir muestras cuando ya tiene minSamples y el error estandar de su
+# luminancia baja de errorThreshold, asi las muestras extra se gastan en
+# bordes y zonas ruidosas. El render termina al llegar a maxSamples, cuando
+# todos los pixeles convergen o cuando se acaba timeBudget (en segundos).
+
+# Pesos de luminancia (Rec. 709)
+LUMINANCE = np.array([0.2126, 0.7152, 0.0722])
+
+# Rayos por lote al trazar una pasada
+CHUNK_SIZE = 4096
+
+class Accumulator(object):
+    def __init__(self, width, height):
+        self.sum = np.zeros((height, width, 3))
+        self.lumSum = np.zeros((height, width))
+        self.lumSqSum = np.zeros((height, width))
+        self.count = np.zeros((height, width), dtype=int)
+
+    def Add(self, y, x, colors):
+        # Cada pixel aparece una sola vez por pasada
+        lum = colors @ LUMINANCE
+        self.sum[y, x] += colors
+        self.lumSum[y, x] += lum
+        self.lumSqSum[y, x] += lum * lum
+        self.count[y, x] += 1
+
+    def Mean(self, y, x):
+        return self.sum[y, x] / self.count[y, x][..., None]
+
+    def Error(self):
+        # Error estandar de la luminancia promedio de cada pixel
+        n = np.maximum(self.count, 1)
+        variance = (self.lumSqSum - self.lumSum ** 2 / n) / np.maximum(n - 1, 1)
+        return np.sqrt(np.maximum(variance, 0) / n)
+
+
+def RenderProgressive(renderer, maxSamples = 16, minSamples = 4, errorThreshold = 0.01, timeBudget = None):
+    start = time.perf_counter()
+    renderer.glPrepareScene()
+
+    x0, y0, x1, y1 = renderer.glVisibleViewport()
+    if x0 >= x1 or y0 >= y1:
+        return np.zeros((0, 0), dtype=int)
+
+    width, height = x1 - x0, y1 - y0
+    accumulator = Accumulator(width, height)
+    orig = np.asarray(renderer.camera.translation, dtype=float)
+
+    # Estratos: una rejilla strata x strata dentro del pixel. Cada pixel la
+    # recorre desde un estrato al azar para que la primera pasada no quede
+    # corrida hacia una esquina.
+    random = np.random.default_rng((renderer.seed, maxSamples))
+    strata = max(1, ceil(maxSamples ** 0.5))
+    firstStratum = random.integers(0, strata * strata, (height, width))
+
+    region = (x0 + renderer.vpX, y0 + renderer.vpY, x1 + renderer.vpX, y1 + renderer.vpY)
+
+    for sample in range(maxSamples):
+        active = accumulator.count < minSamples
+        if sample >= minSamples:
+            active |= (accumulator.count < maxSamples) & (accumulator.Error() > errorThreshold)
+
+        ys, xs = np.nonzero(active)
+        if len(ys) == 0:
+            break
+
+        stratum = (accumulator.count[ys, xs] + firstStratum[ys, xs]) % (strata * strata)
+        jitterX = (stratum % strata + random.random(len(ys))) / strata
+        jitterY = (stratum // strata + random.random(len(ys))) / strata
+
+        outOfTime = False
+
+        for chunk in range(0, len(ys), CHUNK_SIZE):
+            y, x = ys[chunk:chunk + CHUNK_SIZE], xs[chunk:chunk + CHUNK_SIZE]
+
+            renderer.glBeginBatch(sample, chunk)
+
+            dirs = renderer.glPixelRays(x + x0 + jitterX[chunk:chunk + CHUNK_SIZE],
+                                        y + y0 + jitterY[chunk:chunk + CHUNK_SIZE])
+            accumulator.Add(y, x, renderer.glTraceRays(orig, dirs))
+
+            # La primera pasada siempre se completa para tener una imagen entera
+            if sample > 0 and timeBudget is not None and time.perf_counter() - start >= timeBudget:
+                outOfTime = True
+                break
+
+        done = accumulator.count > 0
+        renderer.frameBuffer[region[1]:region[3], region[0]:region[2]][done] = accumulator.Mean(*np.nonzero(done))
+
+        renderer.glBlit(*region)
+        renderer.glPresentUpdate(len(ys), tileDone = True)
+
+        if outOfTime or (timeBudget is not None and time.perf_counter() - start >= timeBudget):
+            break
+
+    if renderer.screen:
+        renderer.glPresent()
+
+    return accumulator.count
@@ -47,6 +47,53 @@ def fresnel(normal, incident, n1, n2):
 	F1 = (((n2 * c1) - (n1 * c2)) / ((n2 * c1) + (n1 * c2))) ** 2
 	F2 = (((n1 * c2) - (n2 * c1)) / ((n1 * c2) + (n2 * c1))) ** 2
 
+	Kr = (F1 + F2) / 2
+	Kt = 1 - Kr
+	return Kr, Kt
+
+
+# Versiones por lotes: normal e incident son arreglos (N,3) y el resultado
+# es un valor por rayo
+
+def _orientBatch(normal, incident, n1, n2):
+	c1 = np.einsum('ij,ij->i', normal, incident)
+	inside = c1 >= 0
+	c1 = np.abs(c1)
+	normal = np.where(inside[:, None], -normal, normal)
+	N1 = np.where(inside, n2, n1)
+	N2 = np.where(inside, n1, n2)
+	return normal, c1, N1, N2
+
+
+def refractVectorBatch(normal, incident, n1, n2):
+	normal, c1, N1, N2 = _orientBatch(normal, incident, n1, n2)
+
+	n = (N1 / N2)[:, None]
+	c1 = c1[:, None]
+
+	T = n * (incident + c1 * normal) - normal * np.sqrt(np.maximum(1 - n**2 * (1 - c1**2), 0))
+
+	return T / np.linalg.norm(T, axis = 1, keepdims = True)
+
+
+def totalInternalReflectionBatch(normal, incident, n1, n2):
+	normal, c1, N1, N2 = _orientBatch(normal, incident, n1, n2)
+
+	theta1 = np.arccos(np.clip(c1, -1, 1))
+	thetaC = np.arcsin(np.clip(N2 / N1, -1, 1))
+
+	return (N1 >= N2) & (theta1 >= thetaC)
+
+
+def fresnelBatch(normal, incident, n1, n2):
+	normal, c1, N1, N2 = _orientBatch(normal, incident, n1, n2)
+
+	s2 = (N1 * np.sqrt(np.maximum(1 - c1**2, 0))) / N2
+	c2 = np.sqrt(np.maximum(1 - s2 ** 2, 0))
+
+	F1 = (((N2 * c1) - (N1 * c2)) / ((N2 * c1) + (N1 * c2))) ** 2
+	F2 = (((N1 * c2) - (N2 * c1)) / ((N1 * c2) + (N2 * c1))) ** 2
+
 	Kr = (F1 + F2) / 2
 	Kt = 1 - Kr
 	return Kr, Kt
\ No newline at end of file
@@ -0,0 +1,27 @@
+# Cache de sombras: por cada luz recuerda el ultimo objeto que la tapo. Los
+# puntos vecinos suelen quedar a la sombra del mismo objeto, asi que ese se
+# prueba primero y solo si no tapa el rayo se hace la consulta completa.
+# El renderer usa uno nuevo por tile, por lo que cada proceso tiene el suyo.
+# Solo se usa en el camino escalar: en los lotes, probar primero el objeto
+# guardado contra todos los rayos costaba mas de lo que ahorraba, porque los
+# rayos que no tapa igual hacen la consulta completa al BVH.
+
+class ShadowCache(object):
+    def __init__(self):
+        self.occluders = {}
+
+    def Occluded(self, renderer, light, point, dir, maxDistance, sceneObj = None):
+        cached = self.occluders.get(light, -1)
+
+        if cached >= 0:
+            obj = renderer.scene[cached]
+            if obj != sceneObj:
+                intercept = obj.ray_intersect(point, dir)
+                if intercept != None and intercept.distance < maxDistance:
+                    return True
+
+        # En zonas iluminadas se olvida el objeto para no probarlo de mas
+        occluder = renderer.glOccluder(point, dir, maxDistance, sceneObj)
+        self.occluders[light] = occluder
+
+        return occluder >= 0
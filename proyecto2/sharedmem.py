@@ -0,0 +1,35 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+# Arreglos de NumPy guardados en bloques de multiprocessing.shared_memory.
+# Al serializarlos solo viaja el nombre del bloque, su forma y su tipo, y el
+# proceso que los recibe se adjunta al mismo bloque sin copiar los datos.
+
+class SharedArray(np.ndarray):
+    def __new__(cls, shape, dtype, shm):
+        array = super().__new__(cls, shape, dtype, buffer = shm.buf)
+        array.shm = shm
+        return array
+
+    def __array_finalize__(self, obj):
+        # Las vistas y copias no son dueñas del bloque
+        self.shm = None
+
+    def __reduce__(self):
+        if self.shm is None:
+            return np.asarray(self).__reduce__()
+        return (_Attach, (self.shm.name, self.shape, self.dtype.str))
+
+
+def _Attach(name, shape, dtype):
+    return SharedArray(shape, dtype, shared_memory.SharedMemory(name = name))
+
+
+def ToShared(array):
+    # Copia un arreglo a un bloque nuevo de memoria compartida. Quien lo crea
+    # debe llamar a shm.unlink() cuando ningun proceso lo necesite.
+    array = np.asarray(array)
+    shm = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+    shared = SharedArray(array.shape, array.dtype, shm)
+    shared[...] = array
+    return shared
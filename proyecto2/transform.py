@@ -0,0 +1,69 @@
+import numpy as np
+from functools import lru_cache
+from Mathlib import TranslationMatrix, RotationMatrix, ScaleMatrix
+
+# Transformaciones afines 4x4 como ndarrays. Las de modelo y de camara se
+# guardan por (traslacion, rotacion, escala), asi que objetos y cuadros que
+# repiten la misma pose comparten la matriz, su inversa y su matriz de
+# normales en lugar de reconstruirlas en cada llamada. Las matrices son de
+# solo lectura porque son compartidas.
+
+# Poses distintas que se recuerdan antes de descartar las menos usadas
+TRANSFORM_CACHE_SIZE = 4096
+
+def ReadOnly(matrix):
+    matrix = np.array(matrix, dtype = float)
+    matrix.setflags(write = False)
+    return matrix
+
+
+class Transform(object):
+    def __init__(self, matrix):
+        self.matrix = ReadOnly(matrix)
+        self.inverse = None
+        self.normalMatrix = None
+
+    def GetInverse(self):
+        if self.inverse is None:
+            self.inverse = ReadOnly(np.linalg.inv(self.matrix))
+        return self.inverse
+
+    def GetNormalMatrix(self):
+        # Inversa transpuesta de la parte 3x3, para llevar normales
+        if self.normalMatrix is None:
+            self.normalMatrix = ReadOnly(np.linalg.inv(self.matrix[:3, :3]).T)
+        return self.normalMatrix
+
+    def TransformPoints(self, points):
+        # Puntos (N,3) o (3,)
+        return points @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+
+    def TransformDirections(self, directions):
+        return directions @ self.matrix[:3, :3].T
+
+    def TransformNormals(self, normals):
+        # Sin normalizar; la escala no uniforme cambia su largo
+        return normals @ self.GetNormalMatrix().T
+
+
+def PoseKey(values):
+    return tuple(float(i) for i in np.ravel(values))
+
+
+@lru_cache(maxsize = TRANSFORM_CACHE_SIZE)
+def _ModelTransform(translation, rotation, scale):
+    return Transform(TranslationMatrix(*translation) @ RotationMatrix(*rotation) @ ScaleMatrix(*scale))
+
+
+@lru_cache(maxsize = TRANSFORM_CACHE_SIZE)
+def _ViewTransform(translation, rotation):
+    # Camara a mundo; la matriz de vista es su inversa
+    return Transform(RotationMatrix(*rotation) @ TranslationMatrix(*translation))
+
+
+def ModelTransform(translation = (0, 0, 0), rotation = (0, 0, 0), scale = (1, 1, 1)):
+    return _ModelTransform(PoseKey(translation), PoseKey(rotation), PoseKey(scale))
+
+
+def ViewTransform(translation = (0, 0, 0), rotation = (0, 0, 0)):
+    return _ViewTransform(PoseKey(translation), PoseKey(rotation))
@@ -0,0 +1,215 @@
+import numpy as np
+from material import OPAQUE, REFLECTIVE, TRANSPARENT
+from Mathlib import reflectVectorBatch
+from refractionFunctions import refractVectorBatch, totalInternalReflectionBatch, fresnelBatch
+
+# Integrador por frentes de onda (wavefront). En lugar de que cada material
+# llame recursivamente a glCastRay, todos los rayos de un mismo nivel se
+# intersectan juntos, los impactos se sombrean por material y los rayos de
+# reflexion y refraccion que generan forman el siguiente frente.
+#
+# Cada rayo recuerda el impacto que lo genero (parent) y con que peso
+# contribuye a su color (coeff: 1, Kr o Kt). Al terminar, los colores se
+# resuelven del ultimo frente al primero con la misma formula que
+# Material.GetSurfaceColor:
+#     min(1, diffuse * (luz + reflexion + refraccion) + especular)
+# weight lleva el producto de esos factores desde la camara (throughput).
+
+def MaterialTable(scene):
+    # Materiales distintos de la escena y, por objeto, el indice de su
+    # material en esa lista (-1 si no tiene)
+    materials = []
+    groupOf = np.full(len(scene), -1)
+    for i, sceneObj in enumerate(scene):
+        if sceneObj.material:
+            for g, material in enumerate(materials):
+                if material is sceneObj.material:
+                    groupOf[i] = g
+                    break
+            else:
+                materials.append(sceneObj.material)
+                groupOf[i] = len(materials) - 1
+
+    return materials, groupOf
+
+
+class Wave(object):
+    def __init__(self, orig, dir, parent, coeff, exclude, weight):
+        self.orig = orig
+        self.dir = dir
+        self.parent = parent
+        self.coeff = coeff
+        self.exclude = exclude
+        self.weight = weight
+
+        # Se llenan al sombrear el frente
+        self.color = None
+        self.hitRay = np.zeros(0, dtype = int)
+        self.diffuse = self.light = self.spec = self.incoming = np.zeros((0, 3))
+
+
+def TraceWavefront(renderer, orig, dirs):
+    # Devuelve el color (N,3) de cada rayo primario
+
+    n = len(dirs)
+    orig = np.array(np.broadcast_to(orig, np.shape(dirs)), dtype = float)
+
+    wave = Wave(orig, np.asarray(dirs, dtype = float), np.arange(n), np.ones(n),
+                np.full(n, -1), np.ones((n, 3)))
+    waves = []
+
+    for depth in range(renderer.maxRecursionDepth + 2):
+        waves.append(wave)
+
+        # Igual que glCastRay, pasado maxRecursionDepth el rayo ya no se
+        # intersecta y toma el color del entorno
+        if depth > renderer.maxRecursionDepth:
+            wave.color = np.array(renderer.glEnvMapColors(wave.orig, wave.dir), dtype = float)
+            break
+
+        wave = ShadeWave(renderer, wave, depth)
+        if wave is None:
+            break
+
+    return ResolveWaves(waves, n)
+
+
+def ShadeWave(renderer, wave, level):
+    # Intersecta y sombrea el frente de profundidad level; devuelve el
+    # siguiente o None
+
+    depth, normal, texCoord, index = renderer.glCastRays(wave.orig, wave.dir, exclude = wave.exclude)
+
+    miss = index < 0
+    wave.color = np.zeros(wave.dir.shape)
+    wave.color[miss] = renderer.glEnvMapColors(wave.orig[miss], wave.dir[miss])
+
+    hitRay = np.nonzero(~miss)[0]
+    wave.hitRay = hitRay
+    wave.diffuse = np.zeros((len(hitRay), 3))
+    wave.light = np.zeros((len(hitRay), 3))
+    wave.spec = np.zeros((len(hitRay), 3))
+    wave.incoming = np.zeros((len(hitRay), 3))
+
+    if len(hitRay) == 0:
+        return None
+
+    obj = index[hitRay]
+    rayDir = wave.dir[hitRay]
+    hits = {
+        'obj': obj,
+        'point': wave.orig[hitRay] + rayDir * depth[hitRay][:, None],
+        'normal': normal[hitRay],
+        'rayDir': rayDir,
+        'texCoord': texCoord[hitRay],
+        'weight': wave.weight[hitRay],
+    }
+
+    # Agrupar los impactos por material, con la tabla que arma glPrepareScene
+    if renderer.materialTable is None or len(renderer.materialTable[1]) != len(renderer.scene):
+        renderer.glBuildMaterialTable()
+    materials, groupOf = renderer.materialTable
+
+    groups = groupOf[obj]
+    children = []
+
+    for g in np.unique(groups):
+        if g >= 0:
+            ShadeGroup(renderer, materials[g], wave, np.nonzero(groups == g)[0], hits, children)
+
+    if not children:
+        return None
+
+    orig, dir, parent, coeff, exclude, weight = [np.concatenate(i) for i in zip(*children)]
+
+    # Se descartan los rayos que casi no aportan al pixel (o que pierden la
+    # ruleta rusa) y los demas se escalan para compensar
+    scale = renderer.glPathWeights(weight, level + 1)
+    keep = np.nonzero(scale > 0)[0]
+    if len(keep) == 0:
+        return None
+
+    scale = scale[keep]
+    return Wave(orig[keep], dir[keep], parent[keep], coeff[keep] * scale,
+                exclude[keep], weight[keep] * scale[:, None])
+
+
+def ShadeGroup(renderer, material, wave, sel, hits, children):
+    # Sombrea los impactos sel, todos con el mismo material, y agrega a
+    # children los rayos secundarios que generan
+
+    obj = hits['obj'][sel]
+    point = hits['point'][sel]
+    normal = hits['normal'][sel]
+    rayDir = hits['rayDir'][sel]
+    texCoord = hits['texCoord'][sel]
+    weight = hits['weight'][sel]
+
+    diffuse = np.tile(np.asarray(material.diffuse, dtype = float), (len(sel), 1))
+
+    if material.texture:
+        hasUV = ~np.isnan(texCoord[:, 0])
+        diffuse[hasUV] *= material.texture.getColors(texCoord[hasUV, 0], texCoord[hasUV, 1])
+
+    lightColor = np.zeros((len(sel), 3))
+    specColor = np.zeros((len(sel), 3))
+    viewPos = renderer.camera.translation
+
+    for light, near in renderer.glLightsForPoints(point):
+        lit = near[~renderer.glShadowedRays(light, point[near], exclude = obj[near])]
+
+        lightDiffuse, lightSpecular = light.EvaluateBatch(point[lit], normal[lit], viewPos, material.spec, material.ks)
+        specColor[lit] += lightSpecular
+
+        if material.matType == OPAQUE:
+            lightColor[lit] += lightDiffuse
+
+    wave.diffuse[sel] = diffuse
+    wave.light[sel] = lightColor
+    wave.spec[sel] = specColor
+
+    if material.matType == REFLECTIVE:
+        reflect = reflectVectorBatch(normal, -rayDir)
+        children.append((point, reflect, sel, np.ones(len(sel)), obj, weight * diffuse))
+
+    if material.matType == TRANSPARENT:
+        outside = np.einsum('ij,ij->i', normal, rayDir) < 0
+
+        bias = normal * 0.001
+
+        reflect = reflectVectorBatch(normal, -rayDir)
+        reflectOrig = np.where(outside[:, None], point + bias, point - bias)
+
+        tir = totalInternalReflectionBatch(normal, rayDir, 1.0, material.ior)
+        Kr, Kt = fresnelBatch(normal, rayDir, 1.0, material.ior)
+
+        # Con reflexion interna total no hay refraccion y la reflexion no se pondera
+        Kr = np.where(tir, 1.0, Kr)
+        children.append((reflectOrig, reflect, sel, Kr, np.full(len(sel), -1), weight * diffuse * Kr[:, None]))
+
+        refr = ~tir
+        if refr.any():
+            refract = refractVectorBatch(normal[refr], rayDir[refr], 1.0, material.ior)
+            refractOrig = np.where(outside[:, None], point - bias, point + bias)[refr]
+            children.append((refractOrig, refract, sel[refr], Kt[refr], np.full(refr.sum(), -1),
+                             (weight * diffuse)[refr] * Kt[refr, None]))
+
+
+def ResolveWaves(waves, n):
+    # Propaga los colores del ultimo frente hacia los rayos primarios
+
+    colors = np.zeros((n, 3))
+
+    for k in reversed(range(len(waves))):
+        wave = waves[k]
+        rayColor = wave.color
+
+        if len(wave.hitRay):
+            rayColor[wave.hitRay] = np.minimum(1, wave.diffuse * (wave.light + wave.incoming) + wave.spec)
+
+        if k == 0:
+            colors[wave.parent] = rayColor
+        else:
+            np.add.at(waves[k - 1].incoming, wave.parent, wave.coeff[:, None] * rayColor)
+
+    return colors